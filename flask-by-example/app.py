@@ -1,92 +1,483 @@
 import os
-import requests
-import operator
-import re
-import nltk
-from flask import Flask, render_template, request, jsonify
+import time
+import uuid
+import hashlib
+from datetime import datetime, timedelta
+import json
+from flask import Flask, Response, render_template, request, jsonify, g
+from flask import stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
-from stop_words import stops
-from collections import Counter
-from bs4 import BeautifulSoup
-from rq import Queue
-from rq.job import Job
+from rq import get_current_job
+from rq.job import Job, JobStatus
 from worker import conn
+from cache import ResultCache, TopWordsCache, content_hash, hashed
+from fetch import Fetcher, BodyTooLarge
+from scheduler import Scheduler
+from wordcount import WordCounter
+from stop_words import StopWordFilter
+from extract import get_extractor
+from metrics import Metrics, Stages, null_timer
+import notify
 
 
 app = Flask(__name__)
 app.config.from_object(os.environ['APP_SETTINGS'])
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = True
 db = SQLAlchemy(app)
 migrate = Migrate(app, db)
 
-q = Queue(connection=conn)
 
-from models import Result
+def dispose_engine():
+  # forked children (work horses, pool workers) start with an empty pool
+  # rather than share the parent's connections, which stay open for it
+  db.engine.dispose(close=False)
+
+
+os.register_at_fork(after_in_child=dispose_engine)
+
+# how long finished jobs and everything derived from them are kept in redis
+RESULT_TTL = 5000
+
+scheduler = Scheduler.from_config(conn, app.config)
+cache = ResultCache(
+    conn,
+    app.config['RESULT_CACHE_TTL'],
+    app.config['RESULT_CACHE_VALIDATOR_TTL']
+)
+top_cache = TopWordsCache(conn, app.config['HOT_CACHE_TOP_N'], RESULT_TTL)
+fetcher = Fetcher.from_config(app.config)
+metrics = Metrics(conn, app.config['METRICS_ENABLED'])
+counter = WordCounter(
+    StopWordFilter(app.config['STOP_WORDS_LANGUAGE']),
+    get_extractor(app.config['TEXT_EXTRACTOR']),
+    tokenizer=app.config['TOKENIZER'],
+    processes=app.config['TOKENIZE_PROCESSES'],
+    parallel_min_chars=app.config['PARALLEL_TOKENIZE_MIN_CHARS']
+)
+
+from models import Result, ResultBlock, WordCount, most_common
+import incremental
+import rollups
+import writeback
+
+write_behind = writeback.WriteBehind.from_config(conn, app.config)
 
 
 def count_and_save_words(url):
+  # tell long-polling and streaming clients as soon as the job is done
+  job = get_current_job()
+  stages = Stages()
+  started = time.perf_counter()
+  try:
+    value, counts = process_url(url, stages)
+  except:
+    scheduler.release(url)
+    notify.publish(conn, notify.failed)
+    observe_job(job, stages, started, 'error')
+    scheduler.dispatch()
+    raise
+  scheduler.release(url)
+  if job is not None and isinstance(value, int):
+    # serve polls of this job from redis without touching the database
+    n = app.config['HOT_CACHE_TOP_N']
+    with stages('publish'):
+      if counts is not None:
+        top_all, top = [most_common(count, n) for count in counts]
+      else:
+        top_all = top_words(value, n, stop_words=True)
+        top = top_words(value, n)
+      top_cache.store(job.id, value, top_all, top)
+  notify.publish(conn, value)
+  observe_job(
+      job, stages, started, 'ok' if isinstance(value, int) else 'error'
+  )
+  scheduler.dispatch()
+  return value
+
+
+def observe_job(job, stages, started, outcome):
+  labels = {'outcome': outcome}
+  queue_wait = None
+  if job is not None:
+    labels['queue'] = job.origin
+    # bulk jobs are created when submitted and enqueued later, so this
+    # includes the time spent in the scheduler's backlog
+    if job.created_at is not None:
+      queue_wait = (datetime.utcnow() - job.created_at).total_seconds()
+      queue_wait -= time.perf_counter() - started
+  metrics.observe_job(
+      stages, time.perf_counter() - started, queue_wait, labels
+  )
+
+
+def process_url(url, stages):
   errors = []
+  streaming = app.config['STREAM_WORD_COUNT']
+  with stages('lookup'):
+    entry = cache.entry(url)
+    if entry is not None and Result.query.get(entry['result_id']) is None:
+      entry = None
   try:
-    r = requests.get(url)
+    with stages('fetch'):
+      r = fetcher.get(
+          url, headers=cache.validators(entry), stream=streaming
+      )
+  except BodyTooLarge:
+    errors.append('The page is too large to analyse.')
+    return {'error': errors}, None
   except:
     errors.append(
         "Unable to get URL. Please make sure it's valid and try again."
     )
-    return {'error': errors}
+    return {'error': errors}, None
+  # a body revalidated from the fetch cache on disk was not transferred
+  from_cache = getattr(r, 'from_cache', False)
+  # unchanged content keeps its existing result
+  if streaming and not from_cache:
+    digest = None
+  else:
+    if not from_cache:
+      stages.fetched_bytes = len(r.content)
+    with stages('lookup'):
+      digest = content_hash(r.content)
+  with stages('lookup'):
+    result_id = cache.revalidate(entry, r.status_code, digest)
+  if result_id is not None:
+    cache.touch(url, entry)
+    return result_id, None
   # text processing
-  raw = BeautifulSoup(r.text, 'html.parser').get_text()
-  nltk.data.path.append('./nltk_data/') # set the path
-  tokens = nltk.word_tokenize(raw)
-  text = nltk.Text(tokens)
-  # remove punctuation, count raw words
-  nonPunct = re.compile('.*[A-Za-z].*')
-  raw_words = [w for w in text if nonPunct.match(w)]
-  raw_word_count = Counter(raw_words)
-  # stop words
-  no_stop_words = [w for w in raw_words if w.lower() not in stops]
-  no_stop_words_count = Counter(no_stop_words)
+  block_changes = None
+  if streaming:
+    sha = hashlib.sha256()
+    chunks = fetcher.iter_content(r, app.config['STREAM_CHUNK_SIZE'])
+    if not from_cache:
+      chunks = stages.fetched(chunks)
+    chunks = hashed(chunks, sha)
+    try:
+      raw_word_count, no_stop_words_count = counter.count_stream(
+          chunks, r.encoding, timer=stages
+      )
+    except BodyTooLarge:
+      errors.append('The page is too large to analyse.')
+      return {'error': errors}, None
+    digest = sha.hexdigest()
+    result_id = cache.revalidate(entry, r.status_code, digest)
+    if result_id is not None:
+      cache.touch(url, entry)
+      return result_id, None
+  elif app.config['INCREMENTAL_REANALYSIS']:
+    raw_word_count, no_stop_words_count, block_changes = (
+        incremental.count_changes(counter, url, r.text, stages)
+    )
+  else:
+    raw_word_count, no_stop_words_count = counter.count(r.text, stages)
   # save the results
-  try:
-    result = Result(
-        url=url,
-        result_all=raw_word_count,
-        result_no_stop_words=no_stop_words_count
+  if app.config['WRITE_BEHIND'] and block_changes is None:
+    # the writer process saves them in a batch later, under this id
+    with stages('save'):
+      result_id = write_behind.result_id(url)
+      write_behind.push(writeback.Pending(
+          url, result_id, raw_word_count, no_stop_words_count
+      ))
+  else:
+    try:
+      result_id = save_counts(
+          url, raw_word_count, no_stop_words_count, block_changes, stages
+      )
+    except:
+      db.session.rollback()
+      errors.append('Unable to add item to database.')
+      return {'error': errors}, None
+  cache.store(url, result_id, r.headers, digest)
+  return result_id, (raw_word_count, no_stop_words_count)
+
+
+def save_counts(
+    url, raw_word_count, no_stop_words_count, block_changes=None,
+    timer=null_timer
+):
+  with timer('save'):
+    previous = rollups.previous(url)
+    id = None
+    if app.config['WRITE_BEHIND']:
+      # a job on the url may have returned this id already, and the writer
+      # keeps the id of a row saved here first
+      id = write_behind.result_id(url)
+    result_id = Result.save(
+        url, raw_word_count, no_stop_words_count,
+        pack=app.config['RESULT_ENCODING'] == 'packed', id=id
     )
-    db.session.add(result)
+    WordCount.query.filter_by(result_id=result_id).delete()
+    n = app.config['TOP_WORDS_STORED']
+    db.session.bulk_insert_mappings(
+        WordCount,
+        WordCount.ranking(result_id, raw_word_count, True, n)
+        + WordCount.ranking(result_id, no_stop_words_count, False, n)
+    )
+    if block_changes is not None:
+      block_changes.save(result_id)
+    else:
+      # the blocks no longer add up to the counts just saved
+      ResultBlock.query.filter_by(result_id=result_id).delete()
+    rollups.update(url, previous, raw_word_count, no_stop_words_count)
+  with timer('commit'):
     db.session.commit()
-    return result.id
-  except:
-    errors.append('Unable to add item to database.')
-    return {'error': errors}
+  return result_id
+
+
+def warm_up():
+  # load the punkt model and the parser once so jobs pay for fetch and count
+  counter.count('<p>Warm up the word counter.</p>')
+
+
+@app.before_request
+def start_timer():
+  g.started = time.perf_counter()
+
+
+@app.after_request
+def observe_request(response):
+  metrics.observe(
+      'wordcount_request_seconds',
+      time.perf_counter() - g.started,
+      endpoint=request.endpoint or 'unknown',
+      method=request.method,
+      status=response.status_code
+  )
+  return response
+
+
+def top_words(result_id, k=10, offset=0, stop_words=False):
+  if offset + k <= app.config['TOP_WORDS_STORED']:
+    rows = WordCount.top(result_id, k, stop_words, offset)
+    if rows:
+      return [(row.word, row.count) for row in rows]
+    if offset and WordCount.top(result_id, 1, stop_words):
+      # ranked at save time, so the page is past the last word
+      return []
+  # ranks beyond the stored ones, or results stored before ranking at save
+  # time, fall back to a bounded heap over the full counts
+  result = Result.query.filter_by(id=result_id).first()
+  if result is None:
+    return None
+  if stop_words:
+    counts = result.result_all
+  else:
+    counts = result.result_no_stop_words
+  return most_common(counts, offset + k)[offset:]
+
+
+def top_words_args(args):
+  k = min(max(args.get('k', 10, type=int), 1), app.config['TOP_WORDS_MAX_K'])
+  page = max(args.get('page', 1, type=int), 1)
+  stop_words = args.get('include_stop_words', 'false').lower() in (
+      'true', '1', 'yes'
+  )
+  return {'k': k, 'offset': (page - 1) * k, 'stop_words': stop_words}
 
 
 @app.route('/', methods=['GET', 'POST'])
 def index():
   results = {}
+  headers = {}
   if request.method == 'POST':
     # get url that the user has entered
     url = request.form['url']
-    job = q.enqueue_call(
-        func=count_and_save_words, args=(url,), result_ttl=5000
-    )
-    print(job.get_id())
-  return render_template('index.html', results=results)
+    result_id = cache.lookup(url)
+    if result_id is not None:
+      results = top_words(result_id)
+    if result_id is None or results is None:
+      results = {}
+      job = scheduler.submit(count_and_save_words, url, RESULT_TTL)
+      print(job.get_id())
+      # lets scripted clients poll /results/<job_key>
+      headers['X-Job-Id'] = job.get_id()
+  return render_template('index.html', results=results), headers
+
+
+@app.route('/results', methods=['GET'])
+def get_results_by_url():
+  result = Result.by_url(request.args.get('url', ''))
+  if result is None:
+    return jsonify({'error': ['No results for this url.']}), 404
+  fetched_at = result.fetched_at
+  return jsonify({
+      'id': result.id,
+      'url': result.url,
+      'fetched_at': fetched_at.isoformat() if fetched_at else None,
+      'results': top_words(result.id, **top_words_args(request.args)),
+  })
+
+
+def job_results(job_key, value, args):
+  if isinstance(value, int):
+    args = top_words_args(args)
+    results = top_cache.get(job_key, **args)
+    if results is None:
+      results = top_words(value, **args)
+    return results
+  return value
 
 
 @app.route('/results/<job_key>', methods=['GET'])
 def get_results(job_key):
-  job = Job.fetch(job_key, connection=conn)
-  if job.is_finished:
-    result = Result.query.filter_by(id=job.result).first()
-    results = sorted(
-        result.result_no_stop_words.items(),
-        key=operator.itemgetter(1),
-        reverse=True
-    )[:10]
+  results = top_cache.get(job_key, **top_words_args(request.args))
+  if results is not None:
     return jsonify(results)
+  job = Job.fetch(job_key, connection=conn)
+  wait = min(
+      request.args.get('wait', 0, type=float),
+      app.config['LONG_POLL_MAX_WAIT']
+  )
+  if wait > 0:
+    done, value = notify.wait_for(conn, job, wait)
   else:
-    return 'Nay!', 202
+    done, value = job.is_finished, job.result
+  if done:
+    results = job_results(job_key, value, request.args)
+    # None until the writer has saved the result under the job's id
+    if results is not None:
+      return jsonify(results)
+  return 'Nay!', 202
+
+
+@app.route('/results/<job_key>/stream', methods=['GET'])
+def stream_results(job_key):
+  job = Job.fetch(job_key, connection=conn)
+  args = request.args.copy()
+  heartbeat = app.config['SSE_HEARTBEAT']
+
+  def events():
+    while True:
+      done, value = notify.wait_for(conn, job, heartbeat)
+      if done:
+        break
+      yield ': keep-alive\n\n'
+    results = job_results(job_key, value, args)
+    while results is None:
+      # finished, but the writer has yet to save the result
+      time.sleep(app.config['WRITE_BEHIND_INTERVAL'])
+      yield ': keep-alive\n\n'
+      results = job_results(job_key, value, args)
+    yield 'event: result\ndata: {}\n\n'.format(json.dumps(results))
+
+  return Response(
+      stream_with_context(events()),
+      mimetype='text/event-stream',
+      headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+  )
+
+
+def batch_key(batch_id):
+  return 'wordcount:batch:{}'.format(batch_id)
+
+
+@app.route('/batch', methods=['POST'])
+def submit_batch():
+  data = request.get_json(silent=True) or {}
+  urls = data.get('urls')
+  if not isinstance(urls, list) or not urls or not all(
+      isinstance(url, str) and url.strip() for url in urls
+  ):
+    return jsonify({'error': ['Expected a JSON body with a list of urls.']}), 400
+  if len(urls) > app.config['BATCH_MAX_URLS']:
+    return jsonify({'error': ['Too many urls in one batch.']}), 413
+  batch_id = uuid.uuid4().hex
+  # bulk jobs wait in the submitter's backlog until the scheduler lets them
+  # onto the bulk queue
+  submitter = str(data.get('submitter') or request.remote_addr)
+  job_ids = scheduler.submit_bulk(
+      count_and_save_words, urls, submitter, RESULT_TTL
+  )
+  with conn.pipeline() as pipe:
+    pipe.rpush(batch_key(batch_id), *job_ids)
+    pipe.expire(batch_key(batch_id), RESULT_TTL)
+    pipe.execute()
+  return jsonify({'batch_id': batch_id, 'total': len(job_ids)}), 202
+
+
+@app.route('/batch/<batch_id>', methods=['GET'])
+def get_batch(batch_id):
+  complete = conn.get(batch_key(batch_id) + ':complete')
+  if complete is not None:
+    return jsonify(json.loads(complete))
+  job_ids = [
+      job_id.decode() for job_id in conn.lrange(batch_key(batch_id), 0, -1)
+  ]
+  if not job_ids:
+    return jsonify({'error': ['Unknown batch.']}), 404
+  jobs = Job.fetch_many(job_ids, connection=conn)
+  result_ids = []
+  failed = 0
+  for job in jobs:
+    # fetch_many loaded the statuses, which a refresh reads again one by one
+    status = job.get_status(refresh=False) if job is not None else None
+    if status is None or status == JobStatus.FAILED:
+      failed += 1
+    elif status == JobStatus.FINISHED:
+      if isinstance(job.result, int):
+        result_ids.append(job.result)
+      else:
+        failed += 1
+  batch = {
+      'batch_id': batch_id,
+      'total': len(job_ids),
+      'finished': len(result_ids),
+      'failed': failed,
+      'pending': len(job_ids) - len(result_ids) - failed,
+      'results': WordCount.summed(result_ids, 10) if result_ids else [],
+  }
+  if not batch['pending'] and Result.query.filter(
+      Result.id.in_(result_ids)
+  ).count() == len(set(result_ids)):
+    # every result is written, so the batch no longer changes
+    conn.set(
+        batch_key(batch_id) + ':complete', json.dumps(batch), ex=RESULT_TTL
+    )
+  return jsonify(batch)
+
+
+@app.route('/stats/domains/<domain>', methods=['GET'])
+def get_domain_stats(domain):
+  domain = domain.lower()
+  return jsonify({
+      'domain': domain,
+      'results': rollups.top_domain_words(
+          domain, **top_words_args(request.args)
+      ),
+  })
+
+
+@app.route('/stats/days', methods=['GET'])
+def get_day_stats():
+  # the last `days` days up to and including `until`, in UTC
+  try:
+    until = request.args.get('until')
+    if until:
+      until = datetime.strptime(until, '%Y-%m-%d').date()
+    else:
+      until = datetime.utcnow().date()
+  except ValueError:
+    return jsonify({'error': ['Expected until as YYYY-MM-DD.']}), 400
+  days = min(max(request.args.get('days', 1, type=int), 1), 366)
+  since = until - timedelta(days=days - 1)
+  return jsonify({
+      'since': since.isoformat(),
+      'until': until.isoformat(),
+      'results': rollups.top_day_words(
+          since, until, **top_words_args(request.args)
+      ),
+  })
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+  return Response(metrics.export(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+  return jsonify(cache.stats())
 
 
 if __name__ == '__main__':
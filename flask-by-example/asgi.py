@@ -0,0 +1,216 @@
+import asyncio
+import json
+import time
+
+from asgiref.wsgi import WsgiToAsgi
+from quart import Quart, Response, g, jsonify, request
+from redis import asyncio as aioredis
+from rq.job import JobStatus
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from werkzeug.exceptions import HTTPException
+
+import app as wsgi
+from models import Result, WordCount
+import notify
+from urls import url_hash
+from worker import redis_url
+
+# the result routes, long polls and streams on one event loop; every other
+# route is app.py's, run in a thread pool by `application` below
+app = Quart(__name__, static_folder=None)
+config = wsgi.app.config
+flask_app = WsgiToAsgi(wsgi.app)
+
+redis = None
+engine = None
+listener = None
+
+
+@app.before_serving
+async def connect():
+  global redis, engine, listener
+  redis = aioredis.Redis(
+      connection_pool=aioredis.BlockingConnectionPool.from_url(
+          redis_url, max_connections=config['ASYNC_REDIS_MAX_CONNECTIONS']
+      )
+  )
+  options = dict(config['SQLALCHEMY_ENGINE_OPTIONS'])
+  # psycopg2 only
+  options.pop('executemany_mode', None)
+  engine = create_async_engine(config['ASYNC_DATABASE_URL'], **options)
+  listener = notify.Listener(redis)
+  listener.start()
+
+
+@app.after_serving
+async def disconnect():
+  await listener.stop()
+  await engine.dispose()
+  await redis.close()
+
+
+@app.before_request
+async def start_timer():
+  g.started = time.perf_counter()
+
+
+@app.after_request
+async def observe_request(response):
+  if wsgi.metrics.enabled:
+    async with redis.pipeline(transaction=False) as pipe:
+      wsgi.metrics.record(pipe, [(
+          'wordcount_request_seconds',
+          time.perf_counter() - g.started,
+          {
+              'endpoint': request.endpoint or 'unknown',
+              'method': request.method,
+              'status': response.status_code,
+          }
+      )])
+      await pipe.execute()
+  return response
+
+
+async def in_thread(func, *args):
+  def call():
+    with wsgi.app.app_context():
+      return func(*args)
+  return await asyncio.get_event_loop().run_in_executor(None, call)
+
+
+async def top_words(result_id, k=10, offset=0, stop_words=False):
+  if offset + k <= config['TOP_WORDS_STORED']:
+    async with AsyncSession(engine) as session:
+      rows = (await session.execute(
+          select(WordCount.word, WordCount.count).where(
+              WordCount.result_id == result_id,
+              WordCount.stop_words == stop_words,
+              WordCount.rank >= offset,
+              WordCount.rank < offset + k
+          ).order_by(WordCount.rank)
+      )).all()
+      ranked = bool(rows)
+      if not rows and offset:
+        # ranked at save time, so the page is past the last word
+        ranked = (await session.execute(
+            select(WordCount.rank).where(
+                WordCount.result_id == result_id,
+                WordCount.stop_words == stop_words,
+                WordCount.rank == 0
+            )
+        )).first() is not None
+    if ranked:
+      return [(row.word, row.count) for row in rows]
+  # decoding the full counts stays synchronous, in a thread
+  return await in_thread(wsgi.top_words, result_id, k, offset, stop_words)
+
+
+async def cached_top_words(job_key, k, offset, stop_words):
+  top_cache = wsgi.top_cache
+  if offset + k > top_cache.n:
+    return None
+  data = await redis.get(top_cache.prefix + job_key)
+  return top_cache.words(data, k, offset, stop_words)
+
+
+async def job_results(job_key, value, args):
+  if isinstance(value, int):
+    args = wsgi.top_words_args(args)
+    results = await cached_top_words(job_key, **args)
+    if results is None:
+      results = await top_words(value, **args)
+    return results
+  return value
+
+
+@app.route('/results', methods=['GET'])
+async def get_results_by_url():
+  async with AsyncSession(engine) as session:
+    result = (await session.execute(
+        select(Result.id, Result.url, Result.fetched_at)
+        .where(Result.url_hash == url_hash(request.args.get('url', '')))
+        .limit(1)
+    )).first()
+  if result is None:
+    return jsonify({'error': ['No results for this url.']}), 404
+  fetched_at = result.fetched_at
+  return jsonify({
+      'id': result.id,
+      'url': result.url,
+      'fetched_at': fetched_at.isoformat() if fetched_at else None,
+      'results': await top_words(
+          result.id, **wsgi.top_words_args(request.args)
+      ),
+  })
+
+
+@app.route('/results/<job_key>', methods=['GET'])
+async def get_results(job_key):
+  results = await cached_top_words(
+      job_key, **wsgi.top_words_args(request.args)
+  )
+  if results is not None:
+    return jsonify(results)
+  wait = min(
+      request.args.get('wait', 0, type=float),
+      config['LONG_POLL_MAX_WAIT']
+  )
+  if wait > 0:
+    done, value = await listener.wait_for(job_key, wait)
+  else:
+    status, value = await notify.job_status(redis, job_key)
+    done = status == JobStatus.FINISHED
+  if done:
+    results = await job_results(job_key, value, request.args)
+    # None until the writer has saved the result under the job's id
+    if results is not None:
+      return jsonify(results)
+  return 'Nay!', 202
+
+
+@app.route('/results/<job_key>/stream', methods=['GET'])
+async def stream_results(job_key):
+  await notify.job_status(redis, job_key)
+  args = request.args.copy()
+  heartbeat = config['SSE_HEARTBEAT']
+
+  async def events():
+    while True:
+      done, value = await listener.wait_for(job_key, heartbeat)
+      if done:
+        break
+      yield b': keep-alive\n\n'
+    results = await job_results(job_key, value, args)
+    while results is None:
+      # finished, but the writer has yet to save the result
+      await asyncio.sleep(config['WRITE_BEHIND_INTERVAL'])
+      yield b': keep-alive\n\n'
+      results = await job_results(job_key, value, args)
+    yield 'event: result\ndata: {}\n\n'.format(
+        json.dumps(results)
+    ).encode()
+
+  response = Response(
+      events(),
+      mimetype='text/event-stream',
+      headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+  )
+  # open until the job finishes, however long that is
+  response.timeout = None
+  return response
+
+
+def serves(scope):
+  try:
+    app.url_map.bind('localhost').match(scope['path'], scope['method'])
+  except HTTPException:
+    return False
+  return True
+
+
+async def application(scope, receive, send):
+  if scope['type'] == 'http' and not serves(scope):
+    await flask_app(scope, receive, send)
+  else:
+    await app(scope, receive, send)
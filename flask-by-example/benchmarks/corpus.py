@@ -0,0 +1,43 @@
+import os
+import random
+
+from stop_words import stops
+
+sizes = [10 * 1024, 100 * 1024, 1024 * 1024, 4 * 1024 * 1024]
+
+
+def make_page(size, seed=0):
+  rng = random.Random(seed)
+  vocabulary = ['word{}'.format(i) for i in range(5000)] + stops
+  parts = ['<!DOCTYPE html><html><head><title>Page {}</title>'.format(seed)]
+  parts.append('<style>body { font-family: sans-serif; }</style>')
+  parts.append('</head><body>')
+  length = sum(len(part) for part in parts)
+  while length < size:
+    if rng.random() < 0.1:
+      part = '<script>var fjs = document.getElementById("x{}");</script>'
+      part = part.format(rng.randrange(1000))
+    else:
+      n = rng.randint(20, 80)
+      words = ' '.join(rng.choice(vocabulary) for _ in range(n))
+      part = '<div class="c"><p>{}.</p></div>\n'.format(words.capitalize())
+    parts.append(part)
+    length += len(part)
+  parts.append('</body></html>')
+  return ''.join(parts)
+
+
+def load(directory=None):
+  # saved pages from a directory, or generated pages of increasing size
+  if directory is None:
+    return [
+        ('generated-{}k.html'.format(size // 1024), make_page(size, seed))
+        for seed, size in enumerate(sizes)
+    ]
+  pages = []
+  for name in sorted(os.listdir(directory)):
+    if name.endswith(('.html', '.htm')):
+      path = os.path.join(directory, name)
+      with open(path, encoding='utf-8', errors='replace') as f:
+        pages.append((name, f.read()))
+  return pages
@@ -0,0 +1,114 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+from benchmarks.load import percentiles, row
+
+settings = {
+    # what the app ran with before the engine was configured per role
+    'before': {
+        'SQLALCHEMY_TRACK_MODIFICATIONS': True,
+        'SQLALCHEMY_ENGINE_OPTIONS': {},
+    },
+    'after': {},
+}
+
+
+def make_counts(seed, n=500):
+  result_all = Counter(
+      {'word{}'.format(i): (seed + i) % 50 + 1 for i in range(n)}
+  )
+  result_no_stop_words = Counter({
+      word: count for i, (word, count) in enumerate(result_all.items())
+      if i % 3
+  })
+  return result_all, result_no_stop_words
+
+
+def save(wsgi, url, i):
+  # the database work of one job, timed from opening an app context
+  start = time.perf_counter()
+  with wsgi.app.app_context():
+    wsgi.save_counts('{}/{}'.format(url, i), *make_counts(i))
+  return time.perf_counter() - start
+
+
+def run_forked(wsgi, url, jobs):
+  # a work horse forked per job, as rq's default worker does
+  seconds = []
+  for i in range(jobs):
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+      status = 1
+      try:
+        os.close(read)
+        os.write(write, repr(save(wsgi, url, i)).encode())
+        status = 0
+      finally:
+        os._exit(status)
+    os.close(write)
+    with os.fdopen(read) as f:
+      seconds.append(float(f.read()))
+    os.waitpid(pid, 0)
+  return seconds
+
+
+def run_simple(wsgi, url, jobs):
+  return [save(wsgi, url, i) for i in range(jobs)]
+
+
+def measure(setting, mode, jobs):
+  # one setting and mode in a fresh process, printing the seconds per job
+  import app as wsgi
+  wsgi.app.config.update(settings[setting])
+  with wsgi.app.app_context():
+    wsgi.db.create_all()
+    if setting == 'before':
+      # work horses shared the parent's pooled connections then, rather
+      # than dispose of them when forked
+      wsgi.db.engine.dispose = lambda close=True: None
+    # the parent has used the database, as a worker that warmed up has
+    wsgi.db.session.query(wsgi.db.func.count(wsgi.Result.id)).scalar()
+  # distinct urls per run, so a shared database gets inserts every time
+  url = 'http://example.com/{}/{}/{}'.format(setting, mode, time.time())
+  if mode == 'fork':
+    seconds = run_forked(wsgi, url, jobs)
+  else:
+    seconds = run_simple(wsgi, url, jobs)
+  print(json.dumps(seconds))
+
+
+def main(jobs=200):
+  jobs = int(jobs)
+  tmp = tempfile.mkdtemp(prefix='wordcount-database-')
+  print(row('seconds per job', []) + '       p50       p95       p99')
+  for setting in settings:
+    for mode in ('fork', 'simple'):
+      env = dict(
+          os.environ,
+          APP_SETTINGS=os.getenv('APP_SETTINGS', 'config.ProductionConfig'),
+          DATABASE_URL=os.getenv(
+              'DATABASE_URL',
+              'sqlite:///{}/{}-{}.db'.format(tmp, setting, mode)
+          ),
+          PROCESS_ROLE='worker',
+      )
+      output = subprocess.run(
+          [sys.executable, '-m', 'benchmarks.database', '--measure', setting,
+           mode, str(jobs)],
+          env=env, stdout=subprocess.PIPE, check=True
+      ).stdout
+      seconds = json.loads(output.decode().splitlines()[-1])
+      print(row('{} {}'.format(setting, mode), percentiles(seconds)))
+
+
+if __name__ == '__main__':
+  if sys.argv[1:2] == ['--measure']:
+    measure(sys.argv[2], sys.argv[3], int(sys.argv[4]))
+  else:
+    main(*sys.argv[1:2])
@@ -0,0 +1,60 @@
+import json
+import sys
+import timeit
+
+import packed
+from benchmarks import corpus
+from stop_words import StopWordFilter
+from extract import get_extractor
+from wordcount import WordCounter
+
+
+def json_decode(result_all, result_no_stop_words):
+  return json.loads(result_all), json.loads(result_no_stop_words)
+
+
+def packed_decode(data, id_words):
+  ids, counts, keep = packed.unpack(data)
+  return packed.decode(list(map(id_words.__getitem__, ids)), counts, keep)
+
+
+def main(directory=None, repeat=20):
+  counter = WordCounter(
+      StopWordFilter(), get_extractor('lxml'), tokenizer='regex'
+  )
+  pages = corpus.load(directory)
+  # a vocabulary shared by every page, as in the vocabulary table
+  word_ids = {}
+  json_size = packed_size = json_time = packed_time = 0
+  for name, html in pages:
+    result_all, result_no_stop_words = counter.count(html)
+    for word in result_all:
+      word_ids.setdefault(word, len(word_ids) + 1)
+    id_words = {id: word for word, id in word_ids.items()}
+    entries = sorted(
+        (word_ids[word], count, word not in result_no_stop_words)
+        for word, count in result_all.items()
+    )
+    data = packed.pack(*map(list, zip(*entries)))
+    stored = json.dumps(result_all), json.dumps(result_no_stop_words)
+    assert packed_decode(data, id_words) == json_decode(*stored)
+    json_size += sum(len(s.encode()) for s in stored)
+    packed_size += len(data)
+    json_time += min(timeit.repeat(
+        lambda: json_decode(*stored), number=1, repeat=repeat
+    ))
+    packed_time += min(timeit.repeat(
+        lambda: packed_decode(data, id_words), number=1, repeat=repeat
+    ))
+  print('{} pages, {} words in the vocabulary'.format(
+      len(pages), len(word_ids)
+  ))
+  print('json   {:9} bytes {:.4f} secs'.format(json_size, json_time))
+  print('packed {:9} bytes {:.4f} secs'.format(packed_size, packed_time))
+  print('{:.1f}x smaller, {:.1f}x faster to decode'.format(
+      json_size / packed_size, json_time / packed_time
+  ))
+
+
+if __name__ == '__main__':
+  main(*sys.argv[1:2])
@@ -0,0 +1,27 @@
+import sys
+import time
+
+from benchmarks import corpus
+from extract import extractors
+
+
+def main(directory=None, repeat=3):
+  pages = corpus.load(directory)
+  total = sum(len(html) for _, html in pages)
+  print('{} pages, {:.1f} MB'.format(len(pages), total / 1024 / 1024))
+  for name, cls in sorted(extractors.items()):
+    extractor = cls()
+    elapsed = 0.0
+    for _ in range(repeat):
+      start = time.perf_counter()
+      for _, html in pages:
+        extractor.text(html)
+      elapsed += time.perf_counter() - start
+    elapsed /= repeat
+    print('{:5} {:.4f} secs {:7.1f} MB/s'.format(
+        name, elapsed, total / 1024 / 1024 / elapsed
+    ))
+
+
+if __name__ == '__main__':
+  main(*sys.argv[1:2])
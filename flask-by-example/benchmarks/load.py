@@ -0,0 +1,247 @@
+import argparse
+import contextlib
+import functools
+import http.server
+import os
+import resource
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks import corpus
+from metrics import quantile
+
+basedir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_args(argv):
+  parser = argparse.ArgumentParser(
+      description='Load test index() and /results/<job_key> end to end.'
+  )
+  parser.add_argument('--jobs', type=int, default=100)
+  parser.add_argument('--concurrency', type=int, default=8)
+  parser.add_argument('--workers', type=int, default=2)
+  parser.add_argument(
+      '--worker-class', default='fork', choices=['fork', 'simple']
+  )
+  parser.add_argument(
+      '--sizes', default='10,100,1024',
+      help='sizes in KB of the generated pages, used in turn'
+  )
+  parser.add_argument(
+      '--pages', help='serve the .html pages in this directory instead'
+  )
+  parser.add_argument(
+      '--redis', help='url of a redis database to use, flushed first '
+      '(default: start a throwaway redis-server)'
+  )
+  parser.add_argument('--redis-server', default='redis-server')
+  parser.add_argument(
+      '--database', help='database url (default: a temporary SQLite file)'
+  )
+  parser.add_argument(
+      '--write-behind', action='store_true',
+      help='save results in batches from a writeback.py process'
+  )
+  parser.add_argument('--timeout', type=float, default=120)
+  return parser.parse_args(argv)
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+
+  def log_message(self, *args):
+    pass
+
+
+def serve_pages(directory):
+  handler = functools.partial(QuietHandler, directory=directory)
+  server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+  threading.Thread(target=server.serve_forever, daemon=True).start()
+  return server
+
+
+def serve_redis(executable):
+  # a real server rather than fakeredis, whose TCP server can't run the
+  # scheduler's Lua scripts
+  with socket.socket() as s:
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+  server = subprocess.Popen(
+      [executable, '--port', str(port), '--bind', '127.0.0.1',
+       '--save', '', '--appendonly', 'no'],
+      stdout=subprocess.DEVNULL
+  )
+  for _ in range(100):
+    try:
+      socket.create_connection(('127.0.0.1', port)).close()
+      break
+    except OSError:
+      time.sleep(0.05)
+  return server, 'redis://127.0.0.1:{}'.format(port)
+
+
+def write_pages(directory, args):
+  if args.pages:
+    pages = corpus.load(args.pages)
+  else:
+    pages = [
+        ('page-{}k.html'.format(size), corpus.make_page(size * 1024, seed))
+        for seed, size in enumerate(int(s) for s in args.sizes.split(','))
+    ]
+  for name, html in pages:
+    with open(os.path.join(directory, name), 'w', encoding='utf-8') as f:
+      f.write(html)
+  return [name for name, _ in pages]
+
+
+def percentiles(values):
+  values = sorted(values)
+  if not values:
+    return [None] * 3
+  return [
+      values[min(int(q * len(values)), len(values) - 1)]
+      for q in (0.5, 0.95, 0.99)
+  ]
+
+
+def row(label, values):
+  return '{:24} {}'.format(label, ' '.join(
+      '{:>9}'.format('-' if v is None else '{:.4f}'.format(v))
+      for v in values
+  ))
+
+
+def run_job(client, url, deadline, wait):
+  # submit through the form like a browser, then long-poll for the result
+  start = time.perf_counter()
+  response = client.post('/', data={'url': url})
+  submitted = time.perf_counter()
+  job_key = response.headers.get('X-Job-Id')
+  if job_key is None:
+    return submitted - start, None, response.status_code == 200
+  while time.perf_counter() < deadline:
+    response = client.get(
+        '/results/{}?wait={}'.format(job_key, wait)
+    )
+    if response.status_code != 202:
+      ok = response.status_code == 200 and isinstance(
+          response.get_json(), list
+      )
+      return submitted - start, time.perf_counter() - start, ok
+  return submitted - start, None, False
+
+
+def run(args, app, urls, workers, log):
+  wait = app.config['LONG_POLL_MAX_WAIT']
+  local = threading.local()
+  deadline = time.perf_counter() + args.timeout
+
+  def job(url):
+    if not hasattr(local, 'client'):
+      local.client = app.test_client()
+    return run_job(local.client, url, deadline, wait)
+
+  try:
+    start = time.perf_counter()
+    # index() prints every job id
+    with contextlib.redirect_stdout(log):
+      with ThreadPoolExecutor(args.concurrency) as executor:
+        results = list(executor.map(job, urls))
+    elapsed = time.perf_counter() - start
+  finally:
+    for worker in workers:
+      worker.send_signal(signal.SIGTERM)
+    for worker in workers:
+      worker.wait()
+  # the largest worker or work horse, now that they have all exited and
+  # been waited for (redis is still running)
+  peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+  return results, elapsed, peak
+
+
+def report(args, results, elapsed, peak, metrics):
+  done = [r for r in results if r[1] is not None]
+  ok = sum(1 for r in done if r[2])
+  print('{} jobs, {} workers, concurrency {}: {} ok, {} failed, {} '
+        'unfinished in {:.2f} secs, {:.2f} jobs/sec'.format(
+            len(results), args.workers, args.concurrency, ok,
+            len(done) - ok, len(results) - len(done), elapsed,
+            ok / elapsed
+        ))
+  print(row('seconds', []) + '       p50       p95       p99')
+  print(row('submit (index)', percentiles([r[0] for r in results])))
+  print(row('submit to result', percentiles([r[1] for r in done])))
+  # stages run in the workers, so these are estimated from the histogram
+  # buckets they record
+  for name, labels, buckets, _, _ in metrics.series():
+    if labels.get('outcome') != 'ok':
+      continue
+    if name == 'wordcount_stage_seconds':
+      label = '{} {}'.format(labels['queue'], labels['stage'])
+    elif name == 'wordcount_queue_wait_seconds':
+      label = '{} queue wait'.format(labels['queue'])
+    else:
+      continue
+    print(row(label, [quantile(q, buckets) for q in (0.5, 0.95, 0.99)]))
+  print('peak worker rss: {:.1f} MB'.format(peak / 1024))
+
+
+def main(argv=None):
+  args = parse_args(argv)
+  tmp = tempfile.mkdtemp(prefix='wordcount-load-')
+  names = write_pages(tmp, args)
+  pages = serve_pages(tmp)
+  redis = None
+  redis_url = args.redis
+  if redis_url is None:
+    redis, redis_url = serve_redis(args.redis_server)
+  env = dict(
+      os.environ,
+      APP_SETTINGS=os.getenv('APP_SETTINGS', 'config.ProductionConfig'),
+      DATABASE_URL=args.database or 'sqlite:///{}/load.db'.format(tmp),
+      REDISTOGO_URL=redis_url,
+      WORKER_CLASS=args.worker_class,
+      WRITE_BEHIND='true' if args.write_behind else 'false',
+  )
+  os.environ.update(env)
+  from app import app, db, conn, metrics
+  conn.flushdb()
+  with app.app_context():
+    db.create_all()
+
+  log = open(os.path.join(tmp, 'workers.log'), 'w')
+  workers = [
+      subprocess.Popen(
+          [sys.executable, 'worker.py'], cwd=basedir, env=env, stdout=log,
+          stderr=subprocess.STDOUT
+      )
+      for _ in range(args.workers)
+  ]
+  if args.write_behind:
+    workers.append(subprocess.Popen(
+        [sys.executable, 'writeback.py'], cwd=basedir, env=env, stdout=log,
+        stderr=subprocess.STDOUT
+    ))
+  urls = [
+      'http://127.0.0.1:{}/{}?job={}'.format(
+          pages.server_port, names[i % len(names)], i
+      )
+      for i in range(args.jobs)
+  ]
+  try:
+    results, elapsed, peak = run(args, app, urls, workers, log)
+    report(args, results, elapsed, peak, metrics)
+    print('worker logs: {}'.format(log.name))
+  finally:
+    if redis is not None:
+      redis.terminate()
+      redis.wait()
+
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
@@ -0,0 +1,51 @@
+import random
+import re
+import timeit
+from collections import Counter
+
+from stop_words import stops, StopWordFilter
+
+
+def make_tokens(n, seed=0):
+  rng = random.Random(seed)
+  vocabulary = ['word{}'.format(i) for i in range(5000)] + stops
+  punctuation = [',', '.', '(', ')', ';', "''", '``', '--', '2019']
+  return [
+      rng.choice(punctuation) if rng.random() < 0.15
+      else rng.choice(vocabulary).capitalize() if rng.random() < 0.1
+      else rng.choice(vocabulary)
+      for _ in range(n)
+  ]
+
+
+def old_path(tokens):
+  nonPunct = re.compile('.*[A-Za-z].*')
+  raw_words = [w for w in tokens if nonPunct.match(w)]
+  raw_word_count = Counter(raw_words)
+  no_stop_words = [w for w in raw_words if w.lower() not in stops]
+  no_stop_words_count = Counter(no_stop_words)
+  return raw_word_count, no_stop_words_count
+
+
+def new_path(tokens, stop_filter):
+  raw_word_count = Counter()
+  stop_filter.count_words(tokens, raw_word_count)
+  return raw_word_count, stop_filter.without_stop_words(raw_word_count)
+
+
+def main(n=100000, repeat=5):
+  tokens = make_tokens(n)
+  stop_filter = StopWordFilter()
+  assert old_path(tokens) == new_path(tokens, stop_filter)
+  old = min(timeit.repeat(lambda: old_path(tokens), number=1, repeat=repeat))
+  new = min(timeit.repeat(
+      lambda: new_path(tokens, stop_filter), number=1, repeat=repeat
+  ))
+  print('{} tokens'.format(n))
+  print('old path: {:.4f} secs'.format(old))
+  print('new path: {:.4f} secs'.format(new))
+  print('speedup:  {:.1f}x'.format(old / new))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,36 @@
+import os
+import sys
+import time
+
+from benchmarks import corpus
+from extract import get_extractor
+from stop_words import StopWordFilter
+from wordcount import WordCounter
+
+
+def timed(counter, html):
+  start = time.perf_counter()
+  counts = counter.count(html)
+  return counts, time.perf_counter() - start
+
+
+def main(processes=None):
+  processes = int(processes or os.cpu_count() or 1)
+  html = corpus.make_page(4 * 1024 * 1024)
+  stop_filter = StopWordFilter()
+  extractor = get_extractor('lxml')
+  sequential = WordCounter(stop_filter, extractor)
+  parallel = WordCounter(
+      stop_filter, extractor, processes=processes, parallel_min_chars=0
+  )
+  expected, elapsed = timed(sequential, html)
+  print('sequential:             {:.2f} secs'.format(elapsed))
+  counts, parallel_elapsed = timed(parallel, html)
+  assert counts == expected, 'parallel counts differ from sequential'
+  print('parallel, {:2} processes: {:.2f} secs, {:.1f}x'.format(
+      processes, parallel_elapsed, elapsed / parallel_elapsed
+  ))
+
+
+if __name__ == '__main__':
+  main(*sys.argv[1:2])
@@ -0,0 +1,60 @@
+import os
+import sys
+import time
+
+from benchmarks import corpus
+from extract import get_extractor
+from stop_words import StopWordFilter
+from wordcount import WordCounter, tokenizers
+
+pages_dir = os.path.join(os.path.dirname(__file__), 'pages')
+
+
+def agreement(a, b):
+  # weighted jaccard: shared counts over all counts
+  words = set(a) | set(b)
+  shared = sum(min(a[w], b[w]) for w in words)
+  total = sum(max(a[w], b[w]) for w in words)
+  return shared / total if total else 1.0
+
+
+def accuracy(counters, directory):
+  print('accuracy against nltk, {}'.format(directory))
+  for name, html in corpus.load(directory):
+    raw, no_stop = counters['nltk'].count(html)
+    regex_raw, regex_no_stop = counters['regex'].count(html)
+    top = set(w for w, _ in no_stop.most_common(10))
+    regex_top = set(w for w, _ in regex_no_stop.most_common(10))
+    print('  {}: all words {:.1%}, without stop words {:.1%}, '
+          'top 10 overlap {}/10'.format(
+              name, agreement(raw, regex_raw),
+              agreement(no_stop, regex_no_stop), len(top & regex_top)
+          ))
+
+
+def throughput(counters, repeat=3):
+  html = corpus.make_page(4 * 1024 * 1024)
+  print('throughput on a generated 4 MB page')
+  for name, counter in sorted(counters.items()):
+    start = time.perf_counter()
+    for _ in range(repeat):
+      counter.count(html)
+    elapsed = (time.perf_counter() - start) / repeat
+    print('  {:5} {:.2f} secs {:6.1f} MB/s'.format(
+        name, elapsed, len(html) / 1024 / 1024 / elapsed
+    ))
+
+
+def main(directory=pages_dir):
+  stop_filter = StopWordFilter()
+  extractor = get_extractor('lxml')
+  counters = {
+      name: WordCounter(stop_filter, extractor, tokenizer=name)
+      for name in tokenizers
+  }
+  accuracy(counters, directory)
+  throughput(counters)
+
+
+if __name__ == '__main__':
+  main(*sys.argv[1:2])
@@ -0,0 +1,115 @@
+import hashlib
+import json
+import time
+
+from urls import url_hash
+
+
+def content_hash(body):
+  return hashlib.sha256(body).hexdigest()
+
+
+def hashed(chunks, digest):
+  for chunk in chunks:
+    digest.update(chunk)
+    yield chunk
+
+
+class ResultCache(object):
+  prefix = 'wordcount:cache:'
+
+  def __init__(self, connection, ttl, validator_ttl):
+    self.connection = connection
+    self.ttl = ttl
+    self.validator_ttl = validator_ttl
+
+  def _key(self, url):
+    return self.prefix + 'url:' + url_hash(url)
+
+  def entry(self, url):
+    data = self.connection.get(self._key(url))
+    if data is None:
+      return None
+    return json.loads(data)
+
+  def lookup(self, url):
+    # a result analysed within the ttl is served without enqueueing a job
+    entry = self.entry(url)
+    if entry is not None and time.time() - entry['stored_at'] < self.ttl:
+      self.connection.incr(self.prefix + 'hits')
+      return entry['result_id']
+    self.connection.incr(self.prefix + 'misses')
+    return None
+
+  def validators(self, entry):
+    headers = {}
+    if entry is None:
+      return headers
+    if entry.get('etag'):
+      headers['If-None-Match'] = entry['etag']
+    if entry.get('last_modified'):
+      headers['If-Modified-Since'] = entry['last_modified']
+    return headers
+
+  def revalidate(self, entry, status_code, digest=None):
+    # an expired entry is still good if the origin says the page is unchanged
+    if entry is None:
+      return None
+    if status_code == 304 or digest == entry['content_hash']:
+      self.connection.incr(self.prefix + 'revalidated')
+      return entry['result_id']
+    return None
+
+  def store(self, url, result_id, headers, digest):
+    entry = {
+        'result_id': result_id,
+        'etag': headers.get('ETag'),
+        'last_modified': headers.get('Last-Modified'),
+        'content_hash': digest,
+        'stored_at': time.time(),
+    }
+    self.connection.set(
+        self._key(url), json.dumps(entry), ex=self.validator_ttl
+    )
+
+  def touch(self, url, entry):
+    entry = dict(entry, stored_at=time.time())
+    self.connection.set(
+        self._key(url), json.dumps(entry), ex=self.validator_ttl
+    )
+
+  def stats(self):
+    names = ['hits', 'misses', 'revalidated']
+    values = self.connection.mget([self.prefix + name for name in names])
+    return {name: int(value or 0) for name, value in zip(names, values)}
+
+
+class TopWordsCache(object):
+  prefix = 'wordcount:top:'
+
+  def __init__(self, connection, n, ttl):
+    self.connection = connection
+    self.n = n
+    self.ttl = ttl
+
+  def store(self, job_id, result_id, all_words, no_stop_words):
+    entry = {
+        'result_id': result_id,
+        'all': all_words,
+        'no_stop_words': no_stop_words,
+    }
+    self.connection.set(self.prefix + job_id, json.dumps(entry), ex=self.ttl)
+
+  def get(self, job_id, k, offset, stop_words):
+    if offset + k > self.n:
+      return None
+    return self.words(
+        self.connection.get(self.prefix + job_id), k, offset, stop_words
+    )
+
+  def words(self, data, k, offset, stop_words):
+    # a page of a stored entry, which an asyncio client may have read
+    if data is None:
+      return None
+    words = json.loads(data)['all' if stop_words else 'no_stop_words']
+    return words[offset:offset + k]
@@ -2,12 +2,126 @@ import os
 basedir = os.path.abspath(os.path.dirname(__file__))
 
 
+def engine_options(database_url, pool_size, max_overflow, pool_recycle):
+  if database_url.startswith('sqlite'):
+    return {}
+  options = {
+      'pool_size': pool_size,
+      'max_overflow': max_overflow,
+      # drop connections the server or a proxy closed while they sat idle
+      'pool_pre_ping': True,
+      'pool_recycle': pool_recycle,
+  }
+  if database_url.startswith('postgres'):
+    # executemany as multi-row statements, for the bulk inserts and updates
+    options['executemany_mode'] = 'values_plus_batch'
+  return options
+
+
+def async_database_url(database_url):
+  # the same database through an asyncio driver, for asgi.py
+  scheme, rest = database_url.split('://', 1)
+  if scheme in ('postgres', 'postgresql', 'postgresql+psycopg2'):
+    return 'postgresql+asyncpg://' + rest
+  if scheme == 'sqlite':
+    return 'sqlite+aiosqlite://' + rest
+  return database_url
+
+
 class Config(object):
   DEBUG = False
   TESTING = False
   CSRF_ENABLED = True
   SECRET_KEY = 'this-really-needs-to-be-changed'
   SQLALCHEMY_DATABASE_URI = os.environ['DATABASE_URL']
+  # heroku's scheme, which SQLAlchemy 1.4 no longer accepts
+  if SQLALCHEMY_DATABASE_URI.startswith('postgres://'):
+    SQLALCHEMY_DATABASE_URI = (
+        'postgresql://' + SQLALCHEMY_DATABASE_URI[len('postgres://'):]
+    )
+  SQLALCHEMY_TRACK_MODIFICATIONS = False
+  # 'web' for the app server, 'worker' for rq workers, whose work horses are
+  # forked per job and need a connection or two each
+  PROCESS_ROLE = os.getenv('PROCESS_ROLE', 'web')
+  DATABASE_POOL_SIZE = int(
+      os.getenv('DATABASE_POOL_SIZE', 2 if PROCESS_ROLE == 'worker' else 5)
+  )
+  DATABASE_MAX_OVERFLOW = int(
+      os.getenv('DATABASE_MAX_OVERFLOW', 1 if PROCESS_ROLE == 'worker' else 10)
+  )
+  DATABASE_POOL_RECYCLE = int(os.getenv('DATABASE_POOL_RECYCLE', 30 * 60))
+  SQLALCHEMY_ENGINE_OPTIONS = engine_options(
+      SQLALCHEMY_DATABASE_URI, DATABASE_POOL_SIZE, DATABASE_MAX_OVERFLOW,
+      DATABASE_POOL_RECYCLE
+  )
+  ASYNC_DATABASE_URL = os.getenv(
+      'ASYNC_DATABASE_URL', async_database_url(SQLALCHEMY_DATABASE_URI)
+  )
+  # requests beyond this wait for a connection rather than open another
+  ASYNC_REDIS_MAX_CONNECTIONS = int(
+      os.getenv('ASYNC_REDIS_MAX_CONNECTIONS', 50)
+  )
+  RESULT_CACHE_TTL = int(os.getenv('RESULT_CACHE_TTL', 60 * 60))
+  RESULT_CACHE_VALIDATOR_TTL = int(
+      os.getenv('RESULT_CACHE_VALIDATOR_TTL', 7 * 24 * 60 * 60)
+  )
+  STREAM_WORD_COUNT = os.getenv('STREAM_WORD_COUNT', 'false') == 'true'
+  STREAM_CHUNK_SIZE = int(os.getenv('STREAM_CHUNK_SIZE', 64 * 1024))
+  BATCH_MAX_URLS = int(os.getenv('BATCH_MAX_URLS', 10000))
+  FETCH_CONNECT_TIMEOUT = float(os.getenv('FETCH_CONNECT_TIMEOUT', 3.05))
+  FETCH_READ_TIMEOUT = float(os.getenv('FETCH_READ_TIMEOUT', 10))
+  FETCH_MAX_BODY_SIZE = int(os.getenv('FETCH_MAX_BODY_SIZE', 10 * 1024 * 1024))
+  FETCH_RETRIES = int(os.getenv('FETCH_RETRIES', 3))
+  FETCH_BACKOFF_FACTOR = float(os.getenv('FETCH_BACKOFF_FACTOR', 0.5))
+  # unset keeps no fetched bodies on disk
+  FETCH_CACHE_DIR = os.getenv('FETCH_CACHE_DIR')
+  FETCH_CACHE_MAX_SIZE = int(
+      os.getenv('FETCH_CACHE_MAX_SIZE', 256 * 1024 * 1024)
+  )
+  STOP_WORDS_LANGUAGE = os.getenv('STOP_WORDS_LANGUAGE', 'english')
+  # 'soup' (BeautifulSoup, the original) or 'lxml' (faster, skips scripts)
+  TEXT_EXTRACTOR = os.getenv('TEXT_EXTRACTOR', 'soup')
+  # 'nltk' (punkt and treebank, the original) or 'regex' (faster, see README)
+  TOKENIZER = os.getenv('TOKENIZER', 'nltk')
+  # tokenize documents of PARALLEL_TOKENIZE_MIN_CHARS or more characters of
+  # text across this many processes
+  TOKENIZE_PROCESSES = int(os.getenv('TOKENIZE_PROCESSES', 1))
+  PARALLEL_TOKENIZE_MIN_CHARS = int(
+      os.getenv('PARALLEL_TOKENIZE_MIN_CHARS', 1024 * 1024)
+  )
+  # keep per-block counts and only tokenize changed blocks on re-analysis;
+  # ignored when streaming
+  INCREMENTAL_REANALYSIS = (
+      os.getenv('INCREMENTAL_REANALYSIS', 'false') == 'true'
+  )
+  # 'json' stores both counts as JSON objects, 'packed' stores word ids into
+  # a shared vocabulary with packed counts and a stop word bitmask
+  RESULT_ENCODING = os.getenv('RESULT_ENCODING', 'json')
+  VOCABULARY_CACHE_SIZE = int(os.getenv('VOCABULARY_CACHE_SIZE', 1000000))
+  # buffer counted results in redis for `python writeback.py` to save in
+  # batches of WRITE_BEHIND_BATCH, at least every WRITE_BEHIND_INTERVAL
+  # seconds; results of incremental re-analyses are still saved by the job
+  WRITE_BEHIND = os.getenv('WRITE_BEHIND', 'false') == 'true'
+  WRITE_BEHIND_BATCH = int(os.getenv('WRITE_BEHIND_BATCH', 200))
+  WRITE_BEHIND_INTERVAL = float(os.getenv('WRITE_BEHIND_INTERVAL', 0.5))
+  TOP_WORDS_STORED = int(os.getenv('TOP_WORDS_STORED', 1000))
+  TOP_WORDS_MAX_K = int(os.getenv('TOP_WORDS_MAX_K', 10000))
+  HOT_CACHE_TOP_N = int(os.getenv('HOT_CACHE_TOP_N', 100))
+  SCHEDULER_BULK_DEPTH = int(os.getenv('SCHEDULER_BULK_DEPTH', 20))
+  SCHEDULER_HOST_CONCURRENCY = int(os.getenv('SCHEDULER_HOST_CONCURRENCY', 2))
+  SCHEDULER_HOST_INTERVAL = float(os.getenv('SCHEDULER_HOST_INTERVAL', 1.0))
+  SCHEDULER_DISPATCH_INTERVAL = float(
+      os.getenv('SCHEDULER_DISPATCH_INTERVAL', 1.0)
+  )
+  # stage and request timings, kept in redis and served on /metrics
+  METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true') == 'true'
+  POOL_MIN_WORKERS = int(os.getenv('POOL_MIN_WORKERS', 1))
+  POOL_MAX_WORKERS = int(os.getenv('POOL_MAX_WORKERS', os.cpu_count() or 1))
+  POOL_JOBS_PER_WORKER = int(os.getenv('POOL_JOBS_PER_WORKER', 5))
+  POOL_MAX_LATENCY = float(os.getenv('POOL_MAX_LATENCY', 10))
+  POOL_INTERVAL = float(os.getenv('POOL_INTERVAL', 5))
+  LONG_POLL_MAX_WAIT = float(os.getenv('LONG_POLL_MAX_WAIT', 25))
+  SSE_HEARTBEAT = float(os.getenv('SSE_HEARTBEAT', 15))
 
 
 class ProductionConfig(Config):
@@ -0,0 +1,108 @@
+from html.parser import HTMLParser
+
+from bs4 import BeautifulSoup
+
+
+class _TextCollector(HTMLParser):
+
+  def __init__(self):
+    super().__init__(convert_charrefs=True)
+    self.parts = []
+
+  def handle_data(self, data):
+    self.parts.append(data)
+
+  def pop_text(self):
+    text = ''.join(self.parts)
+    self.parts = []
+    return text
+
+
+class SoupExtractor(object):
+  # the original extraction, script and style contents included
+
+  def text(self, html):
+    return BeautifulSoup(html, 'html.parser').get_text()
+
+  def parser(self):
+    return _TextCollector()
+
+
+skipped_tags = frozenset(['script', 'style', 'noscript', 'template'])
+block_tags = frozenset([
+    'address', 'article', 'aside', 'blockquote', 'br', 'dd', 'div', 'dl',
+    'dt', 'figcaption', 'footer', 'form', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+    'header', 'hr', 'li', 'main', 'nav', 'ol', 'p', 'pre', 'section',
+    'table', 'td', 'th', 'title', 'tr', 'ul'
+])
+
+
+class _LxmlTarget(object):
+
+  def __init__(self):
+    self.parts = []
+    self.skipping = 0
+
+  def start(self, tag, attrib):
+    if tag in skipped_tags:
+      self.skipping += 1
+
+  def end(self, tag):
+    if tag in skipped_tags:
+      self.skipping -= 1
+      self.parts.append('\n')
+    elif tag in block_tags:
+      self.parts.append('\n')
+
+  def data(self, data):
+    if not self.skipping:
+      self.parts.append(data)
+
+  def comment(self, text):
+    pass
+
+  def close(self):
+    pass
+
+
+class _LxmlParser(object):
+
+  def __init__(self, etree):
+    self.target = _LxmlTarget()
+    self.parser = etree.HTMLParser(target=self.target)
+
+  def feed(self, data):
+    self.parser.feed(data)
+
+  def pop_text(self):
+    text = ''.join(self.target.parts)
+    self.target.parts = []
+    return text
+
+  def close(self):
+    self.parser.close()
+
+
+class LxmlExtractor(object):
+  # libxml2 parses in C and drops script, style and noscript contents while
+  # parsing, instead of building a tree and walking it in Python
+
+  def __init__(self):
+    from lxml import etree
+    self.etree = etree
+
+  def text(self, html):
+    parser = self.parser()
+    parser.feed(html)
+    parser.close()
+    return parser.pop_text()
+
+  def parser(self):
+    return _LxmlParser(self.etree)
+
+
+extractors = {'soup': SoupExtractor, 'lxml': LxmlExtractor}
+
+
+def get_extractor(name):
+  return extractors[name]()
@@ -0,0 +1,239 @@
+import hashlib
+import json
+import logging
+import os
+import struct
+import tempfile
+import time
+import zlib
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from urllib3.util.retry import Retry
+
+from urls import url_hash
+
+logger = logging.getLogger(__name__)
+
+
+class BodyTooLarge(Exception):
+  pass
+
+
+class DiskCache(object):
+  # fetched bodies on local disk, compressed and keyed by url, with the
+  # validators to revalidate them; the least recently used entries go once
+  # the directory holds more than max_size bytes
+  header = struct.Struct('<I')
+  kept_headers = ('Content-Type', 'ETag', 'Last-Modified')
+
+  def __init__(self, directory, max_size=256 * 1024 * 1024, level=6):
+    self.directory = directory
+    self.max_size = max_size
+    self.level = level
+    os.makedirs(directory, exist_ok=True)
+
+  def _path(self, url):
+    return os.path.join(self.directory, url_hash(url) + '.entry')
+
+  def cacheable(self, headers):
+    # a body without validators can never be revalidated
+    return 'ETag' in headers or 'Last-Modified' in headers
+
+  def get(self, url):
+    try:
+      with open(self._path(url), 'rb') as f:
+        size, = self.header.unpack(f.read(self.header.size))
+        entry = json.loads(f.read(size).decode())
+        compressed = f.read()
+      entry['body'] = zlib.decompress(compressed)
+    except (OSError, ValueError, struct.error, zlib.error):
+      return None
+    entry['compressed'] = compressed
+    return entry
+
+  def validators(self, entry):
+    headers = {}
+    if entry['headers'].get('ETag'):
+      headers['If-None-Match'] = entry['headers']['ETag']
+    if entry['headers'].get('Last-Modified'):
+      headers['If-Modified-Since'] = entry['headers']['Last-Modified']
+    return headers
+
+  def response(self, url, entry, not_modified):
+    # the stored body as a 200, updated with any validators the 304 sent
+    headers = dict(entry['headers'])
+    for name in self.kept_headers[1:]:
+      if name in not_modified.headers:
+        headers[name] = not_modified.headers[name]
+    if headers != entry['headers']:
+      self.write(url, headers, entry['compressed'], entry['content_hash'])
+    else:
+      self.touch(url)
+    response = requests.Response()
+    response.status_code = 200
+    response.url = not_modified.url
+    response.headers = CaseInsensitiveDict(headers)
+    response.encoding = get_encoding_from_headers(response.headers)
+    response._content = entry['body']
+    response._content_consumed = True
+    response.from_cache = True
+    return response
+
+  def storing(self, url, headers, chunks):
+    # store a streamed body once it has been read to the end
+    compressor = zlib.compressobj(self.level)
+    sha = hashlib.sha256()
+    parts = []
+    for chunk in chunks:
+      sha.update(chunk)
+      parts.append(compressor.compress(chunk))
+      yield chunk
+    parts.append(compressor.flush())
+    self.write(url, headers, b''.join(parts), sha.hexdigest())
+
+  def write(self, url, headers, compressed, digest):
+    entry = json.dumps({
+        'headers': {
+            name: headers[name] for name in self.kept_headers
+            if headers.get(name)
+        },
+        'content_hash': digest,
+        'stored_at': time.time(),
+    }).encode()
+    # written aside and renamed, so other processes never read half of it
+    path = None
+    try:
+      fd, path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+      with os.fdopen(fd, 'wb') as f:
+        f.write(self.header.pack(len(entry)))
+        f.write(entry)
+        f.write(compressed)
+      os.replace(path, self._path(url))
+    except OSError:
+      # the cache is only an optimisation, so a full disk fails no job
+      logger.exception('Unable to cache the body of %s', url)
+      if path is not None and os.path.exists(path):
+        os.remove(path)
+      return
+    self.evict()
+
+  def touch(self, url):
+    try:
+      os.utime(self._path(url))
+    except OSError:
+      pass
+
+  def evict(self):
+    # modification times order the entries, as hits touch them
+    entries = []
+    for item in os.scandir(self.directory):
+      try:
+        stat = item.stat()
+      except OSError:
+        continue
+      if item.name.endswith('.entry'):
+        entries.append((stat.st_mtime, stat.st_size, item.path))
+      elif item.name.endswith('.tmp') and time.time() - stat.st_mtime > 3600:
+        # left by a process that died while writing
+        entries.append((0, 0, item.path))
+    total = sum(size for _, size, _ in entries)
+    for mtime, size, path in sorted(entries):
+      if total <= self.max_size and mtime:
+        break
+      try:
+        os.remove(path)
+      except OSError:
+        continue
+      total -= size
+
+
+class Fetcher(object):
+
+  def __init__(
+      self, connect_timeout=3.05, read_timeout=10, max_body_size=None,
+      retries=3, backoff_factor=0.5, pool_hosts=10, cache=None
+  ):
+    self.timeout = (connect_timeout, read_timeout)
+    self.max_body_size = max_body_size
+    self.cache = cache
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=(429, 500, 502, 503, 504)
+    )
+    # keep-alive connections to the last pool_hosts origins, reused by the
+    # jobs a process runs one after another
+    adapter = HTTPAdapter(
+        pool_connections=pool_hosts, pool_maxsize=1, max_retries=retry
+    )
+    self.session = requests.Session()
+    self.session.mount('http://', adapter)
+    self.session.mount('https://', adapter)
+
+  @classmethod
+  def from_config(cls, config):
+    cache = None
+    if config['FETCH_CACHE_DIR']:
+      cache = DiskCache(
+          config['FETCH_CACHE_DIR'], config['FETCH_CACHE_MAX_SIZE']
+      )
+    return cls(
+        connect_timeout=config['FETCH_CONNECT_TIMEOUT'],
+        read_timeout=config['FETCH_READ_TIMEOUT'],
+        max_body_size=config['FETCH_MAX_BODY_SIZE'],
+        retries=config['FETCH_RETRIES'],
+        backoff_factor=config['FETCH_BACKOFF_FACTOR'],
+        cache=cache
+    )
+
+  def get(self, url, headers=None, stream=False):
+    cached = None
+    if self.cache is not None:
+      cached = self.cache.get(url)
+    if cached is not None:
+      # revalidate the body on disk, rather than whatever the caller saw
+      headers = {
+          name: value for name, value in (headers or {}).items()
+          if name not in ('If-None-Match', 'If-Modified-Since')
+      }
+      headers.update(self.cache.validators(cached))
+    r = self.session.get(
+        url, headers=headers, timeout=self.timeout, stream=True
+    )
+    if r.status_code == 304 and cached is not None:
+      r.close()
+      return self.cache.response(url, cached, r)
+    length = r.headers.get('Content-Length')
+    if self.max_body_size and length and int(length) > self.max_body_size:
+      r.close()
+      raise BodyTooLarge(url)
+    if (
+        self.cache is not None and r.status_code == 200
+        and self.cache.cacheable(r.headers)
+    ):
+      # iter_content stores the body once it has all been read
+      r.cache_url = url
+    if not stream:
+      # read the body ourselves so the size limit also holds without a
+      # Content-Length header, then let requests serve it as usual
+      r._content = b''.join(self.iter_content(r, 64 * 1024))
+    return r
+
+  def iter_content(self, response, chunk_size):
+    chunks = self.read_content(response, chunk_size)
+    url = getattr(response, 'cache_url', None)
+    if url is not None:
+      chunks = self.cache.storing(url, response.headers, chunks)
+    return chunks
+
+  def read_content(self, response, chunk_size):
+    size = 0
+    for chunk in response.iter_content(chunk_size=chunk_size):
+      size += len(chunk)
+      if self.max_body_size and size > self.max_body_size:
+        response.close()
+        raise BodyTooLarge(response.url)
+      yield chunk
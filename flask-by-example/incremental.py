@@ -0,0 +1,102 @@
+import hashlib
+from collections import Counter
+
+from app import db
+from metrics import null_timer
+from models import Result, ResultBlock
+from urls import url_hash
+
+
+def block_hash(text):
+  return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class BlockChanges(object):
+
+  def __init__(self, occurrences, stored, block_counts):
+    self.occurrences = occurrences
+    self.stored = stored
+    self.block_counts = block_counts
+
+  def save(self, result_id):
+    if not self.stored:
+      # counted from scratch, so whatever another job saved meanwhile goes
+      ResultBlock.query.filter_by(result_id=result_id).delete()
+    removed = []
+    updated = []
+    added = []
+    for hash, word_count in self.block_counts.items():
+      occurrences = self.occurrences[hash]
+      row = {
+          'result_id': result_id,
+          'hash': hash,
+          'occurrences': occurrences,
+      }
+      if not occurrences:
+        removed.append(hash)
+      elif hash in self.stored:
+        updated.append(row)
+      else:
+        added.append(dict(row, word_count=word_count))
+    if removed:
+      ResultBlock.query.filter(
+          ResultBlock.result_id == result_id, ResultBlock.hash.in_(removed)
+      ).delete(synchronize_session=False)
+    db.session.bulk_update_mappings(ResultBlock, updated)
+    db.session.bulk_insert_mappings(ResultBlock, added)
+
+
+def count_changes(counter, url, html, timer=null_timer):
+  # re-tokenize only the blocks that weren't there last time and move the
+  # stored totals by the counts of blocks that appeared or disappeared
+  texts = {}
+  occurrences = Counter()
+  for text in counter.blocks(html, timer):
+    hash = block_hash(text)
+    texts[hash] = text
+    occurrences[hash] += 1
+  # lock the url before diffing, so a concurrent re-analysis of it waits
+  # for this one and diffs against the blocks it saves; the same lock
+  # rollups.previous takes, taken first
+  Result.lock(url)
+  result = Result.query.filter_by(
+      url_hash=url_hash(url)
+  ).with_for_update().first()
+  stored = {}
+  if result is not None:
+    stored = dict(
+        db.session.query(ResultBlock.hash, ResultBlock.occurrences)
+        .filter_by(result_id=result.id)
+    )
+  changed = [
+      hash for hash in set(occurrences) | set(stored)
+      if occurrences[hash] != stored.get(hash, 0)
+  ]
+  old_counts = {}
+  if stored:
+    raw_word_count = Counter(result.result_all)
+    reused = [hash for hash in changed if hash in stored]
+    if reused:
+      old_counts = {
+          block.hash: block.word_count for block in ResultBlock.query.filter(
+              ResultBlock.result_id == result.id, ResultBlock.hash.in_(reused)
+          )
+      }
+  else:
+    # nothing stored per block yet, so every block counts as new
+    raw_word_count = Counter()
+  block_counts = {}
+  for hash in changed:
+    word_count = old_counts.get(hash)
+    if word_count is None:
+      word_count = counter.count_text(texts[hash], timer)
+    block_counts[hash] = word_count
+    delta = occurrences[hash] - stored.get(hash, 0)
+    for word, count in word_count.items():
+      raw_word_count[word] += delta * count
+  raw_word_count = +raw_word_count
+  return (
+      raw_word_count,
+      counter.stop_filter.without_stop_words(raw_word_count),
+      BlockChanges(occurrences, stored, block_counts)
+  )
@@ -0,0 +1,186 @@
+import json
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+
+time_buckets = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300
+)
+byte_buckets = tuple(1024 * 4 ** i for i in range(9))
+
+# name: (help, buckets)
+histograms = {
+    'wordcount_stage_seconds': (
+        'Time spent in each stage of a word count job', time_buckets
+    ),
+    'wordcount_job_seconds': (
+        'Time spent running a word count job', time_buckets
+    ),
+    'wordcount_queue_wait_seconds': (
+        'Time from submitting a job to a worker starting it', time_buckets
+    ),
+    'wordcount_fetched_bytes': (
+        'Bytes of page content fetched by a word count job', byte_buckets
+    ),
+    'wordcount_request_seconds': (
+        'Time spent handling a request, up to the first byte', time_buckets
+    ),
+}
+
+
+def null_timer(stage):
+  return nullcontext()
+
+
+def bound(value):
+  return repr(value)
+
+
+class Stages(object):
+  # seconds spent in each stage of one job, summed over every time it is
+  # entered, and the bytes fetched
+
+  def __init__(self):
+    self.seconds = Counter()
+    self.fetched_bytes = 0
+
+  @contextmanager
+  def __call__(self, stage):
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.seconds[stage] += time.perf_counter() - start
+
+  def fetched(self, chunks):
+    # time the reads of a streamed body and add up its bytes
+    chunks = iter(chunks)
+    while True:
+      with self('fetch'):
+        try:
+          chunk = next(chunks)
+        except StopIteration:
+          return
+      self.fetched_bytes += len(chunk)
+      yield chunk
+
+
+class Metrics(object):
+  # histograms kept in redis, so the web and worker processes add to the
+  # same series and any of them can export them
+  prefix = 'wordcount:metrics:'
+
+  def __init__(self, connection, enabled=True):
+    self.connection = connection
+    self.enabled = enabled
+
+  def observe_many(self, observations):
+    # [(name, value, labels)] in one round trip
+    if not self.enabled or not observations:
+      return
+    with self.connection.pipeline(transaction=False) as pipe:
+      self.record(pipe, observations)
+      pipe.execute()
+
+  def record(self, pipe, observations):
+    # queue the commands on a pipeline, which may be an asyncio one
+    for name, value, labels in observations:
+      series = json.dumps([name, labels], sort_keys=True)
+      key = self.prefix + series
+      le = next((b for b in histograms[name][1] if value <= b), float('inf'))
+      pipe.sadd(self.prefix + 'series', series)
+      pipe.hincrby(key, bound(le), 1)
+      pipe.hincrbyfloat(key, 'sum', value)
+      pipe.hincrby(key, 'count', 1)
+
+  def observe(self, name, value, **labels):
+    self.observe_many([(name, value, labels)])
+
+  def observe_job(self, stages, seconds, queue_wait, labels):
+    observations = [
+        ('wordcount_stage_seconds', value, dict(labels, stage=stage))
+        for stage, value in stages.seconds.items()
+    ]
+    observations.append(('wordcount_job_seconds', seconds, labels))
+    observations.append(
+        ('wordcount_fetched_bytes', stages.fetched_bytes, labels)
+    )
+    if queue_wait is not None:
+      observations.append(('wordcount_queue_wait_seconds', queue_wait, labels))
+    self.observe_many(observations)
+
+  def series(self):
+    # [(name, labels, counts per bucket bound, sum, count)]
+    members = sorted(self.connection.smembers(self.prefix + 'series'))
+    with self.connection.pipeline(transaction=False) as pipe:
+      for member in members:
+        pipe.hgetall(self.prefix + member.decode())
+      values = pipe.execute()
+    series = []
+    for member, fields in zip(members, values):
+      name, labels = json.loads(member)
+      if name not in histograms or not fields:
+        continue
+      fields = {key.decode(): value for key, value in fields.items()}
+      buckets = histograms[name][1] + (float('inf'),)
+      counts = [int(fields.get(bound(b), 0)) for b in buckets]
+      series.append((
+          name, labels, list(zip(buckets, counts)),
+          float(fields.get('sum', 0)), int(fields.get('count', 0))
+      ))
+    return series
+
+  def export(self):
+    # the Prometheus text format, buckets made cumulative
+    lines = []
+    last = None
+    for name, labels, buckets, total_sum, count in self.series():
+      if name != last:
+        lines.append('# HELP {} {}'.format(name, histograms[name][0]))
+        lines.append('# TYPE {} histogram'.format(name))
+        last = name
+      total = 0
+      for le, n in buckets:
+        total += n
+        le = '+Inf' if le == float('inf') else bound(le)
+        lines.append('{}_bucket{} {}'.format(
+            name, format_labels(labels, le=le), total
+        ))
+      lines.append('{}_sum{} {}'.format(
+          name, format_labels(labels), total_sum
+      ))
+      lines.append('{}_count{} {}'.format(name, format_labels(labels), count))
+    return '\n'.join(lines) + '\n'
+
+
+def quantile(q, buckets):
+  # estimate from (upper bound, count) buckets like Prometheus'
+  # histogram_quantile, interpolating within the bucket it falls in
+  total = sum(n for _, n in buckets)
+  if not total:
+    return None
+  rank = q * total
+  lower = 0
+  seen = 0
+  for le, n in buckets:
+    if seen + n >= rank and n:
+      if le == float('inf'):
+        return lower
+      return lower + (le - lower) * (rank - seen) / n
+    seen += n
+    lower = le
+  return lower
+
+
+def format_labels(labels, **extra):
+  labels = dict(labels, **extra)
+  if not labels:
+    return ''
+  return '{' + ','.join(
+      '{}="{}"'.format(
+          key,
+          str(value).replace('\\', r'\\').replace('"', r'\"')
+          .replace('\n', r'\n')
+      )
+      for key, value in sorted(labels.items())
+  ) + '}'
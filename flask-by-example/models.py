@@ -1,5 +1,31 @@
-from app import db
+from datetime import datetime
+import heapq
+from app import app, db
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.dialects.postgresql import JSON
+import packed
+from urls import url_hash
+
+# vocabulary ids never change once assigned, so each process keeps a copy
+word_ids = {}
+id_words = {}
+
+
+def most_common(counts, n=None):
+  # count descending, then word, so ties rank the same whichever order the
+  # counts were built or decoded in
+  def key(item):
+    return -item[1], item[0]
+  if n is None:
+    return sorted(counts.items(), key=key)
+  return heapq.nsmallest(n, counts.items(), key=key)
+
+
+def upsert(table):
+  # INSERT ... ON CONFLICT for the database in use
+  if db.engine.dialect.name == 'sqlite':
+    return sqlite.insert(table)
+  return postgresql.insert(table)
 
 
 class Result(db.Model):
@@ -7,13 +33,302 @@ class Result(db.Model):
 
   id = db.Column(db.Integer, primary_key=True)
   url = db.Column(db.String())
-  result_all = db.Column(JSON)
-  result_no_stop_words = db.Column(JSON)
+  url_hash = db.Column(db.String(40), index=True, unique=True)
+  fetched_at = db.Column(db.DateTime)
+  # the full counts are only loaded on access, top words come from WordCount;
+  # they are stored either as two JSON objects or packed against Vocabulary
+  _result_all = db.deferred(db.Column('result_all', JSON), group='counts')
+  _result_no_stop_words = db.deferred(
+      db.Column('result_no_stop_words', JSON), group='counts'
+  )
+  packed_counts = db.deferred(db.Column(db.LargeBinary), group='counts')
+  _decoded = None
 
   def __init__(self, url, result_all, result_no_stop_words):
     self.url = url
-    self.result_all = result_all
-    self.result_no_stop_words = result_no_stop_words
+    self.url_hash = url_hash(url)
+    self._result_all = result_all
+    self._result_no_stop_words = result_no_stop_words
+    self.fetched_at = datetime.utcnow()
+
+  def counts(self):
+    data = self.packed_counts
+    if data is None:
+      return self._result_all, self._result_no_stop_words
+    if self._decoded is None or self._decoded[0] is not data:
+      ids, counts, keep = packed.unpack(data)
+      self._decoded = (
+          data, packed.decode(Vocabulary.words(ids), counts, keep)
+      )
+    return self._decoded[1]
+
+  @property
+  def result_all(self):
+    return self.counts()[0]
+
+  @property
+  def result_no_stop_words(self):
+    return self.counts()[1]
+
+  @classmethod
+  def by_url(cls, url):
+    return cls.query.filter_by(url_hash=url_hash(url)).first()
+
+  @classmethod
+  def row(cls, url, result_all, result_no_stop_words, pack=False):
+    if pack:
+      counts = {
+          'result_all': db.null(),
+          'result_no_stop_words': db.null(),
+          'packed_counts': cls.pack(result_all, result_no_stop_words),
+      }
+    else:
+      counts = {
+          'result_all': result_all,
+          'result_no_stop_words': result_no_stop_words,
+          'packed_counts': None,
+      }
+    return dict(
+        url=url,
+        url_hash=url_hash(url),
+        fetched_at=datetime.utcnow(),
+        **counts
+    )
+
+  @classmethod
+  def upsert_rows(cls, rows):
+    # one row per normalized url, updated in place on re-analysis
+    stmt = upsert(cls.__table__).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['url_hash'],
+        set_={
+            name: stmt.excluded[name] for name in rows[0]
+            if name not in ('id', 'url_hash')
+        }
+    )
+    db.session.execute(stmt)
+
+  @classmethod
+  def save(cls, url, result_all, result_no_stop_words, pack=False, id=None):
+    row = cls.row(url, result_all, result_no_stop_words, pack)
+    if id is not None:
+      # only used when the url has no row yet
+      row['id'] = id
+    cls.upsert_rows([row])
+    return db.session.query(cls.id).filter_by(url_hash=url_hash(url)).scalar()
+
+  @classmethod
+  def save_many(cls, rows):
+    # rows with their ids allocated up front; returns the id of each
+    # url_hash, which is the existing one for urls saved before
+    for i in range(0, len(rows), 500):
+      cls.upsert_rows(rows[i:i + 500])
+    return dict(
+        db.session.query(cls.url_hash, cls.id)
+        .filter(cls.url_hash.in_([row['url_hash'] for row in rows]))
+    )
+
+  @staticmethod
+  def next_id():
+    return db.session.execute(
+        "SELECT nextval(pg_get_serial_sequence('results', 'id'))"
+    ).scalar()
+
+  @staticmethod
+  def lock(url):
+    # a url's saves in turn until the transaction ends, including the
+    # first ones, which have no row to lock yet
+    if db.engine.dialect.name == 'postgresql':
+      db.session.execute(
+          'SELECT pg_advisory_xact_lock(hashtext(:hash))',
+          {'hash': url_hash(url)}
+      )
+
+  @staticmethod
+  def pack(result_all, result_no_stop_words):
+    ids = Vocabulary.ids(result_all)
+    entries = sorted(
+        (ids[word], count, word not in result_no_stop_words)
+        for word, count in result_all.items()
+    )
+    return packed.pack(
+        [id for id, _, _ in entries],
+        [count for _, count, _ in entries],
+        [stop for _, _, stop in entries]
+    )
 
   def __repr__(self):
     return '<id {}>'.format(self.id)
+
+
+class WordCount(db.Model):
+  __tablename__ = 'word_counts'
+
+  result_id = db.Column(
+      db.Integer,
+      db.ForeignKey('results.id', ondelete='CASCADE'),
+      primary_key=True
+  )
+  stop_words = db.Column(db.Boolean, primary_key=True)
+  rank = db.Column(db.Integer, primary_key=True)
+  word = db.Column(db.String(), nullable=False)
+  count = db.Column(db.Integer, nullable=False)
+
+  @staticmethod
+  def ranking(result_id, word_count, stop_words, n):
+    return [
+        {
+            'result_id': result_id,
+            'stop_words': stop_words,
+            'rank': rank,
+            'word': word,
+            'count': count,
+        }
+        for rank, (word, count) in enumerate(most_common(word_count, n))
+    ]
+
+  @classmethod
+  def summed(cls, result_ids, n, stop_words=False):
+    # the top words of several results together, from the ranks each one
+    # stored
+    total = db.func.sum(cls.count)
+    query = db.session.query(cls.word, total).filter(
+        cls.result_id.in_(result_ids), cls.stop_words == stop_words
+    ).group_by(cls.word).order_by(total.desc(), cls.word).limit(n)
+    return [(word, int(count)) for word, count in query]
+
+  @classmethod
+  def top(cls, result_id, n, stop_words=False, offset=0):
+    return cls.query.filter(
+        cls.result_id == result_id,
+        cls.stop_words == stop_words,
+        cls.rank >= offset,
+        cls.rank < offset + n
+    ).order_by(cls.rank).all()
+
+  def __repr__(self):
+    return '<word {} {}>'.format(self.word, self.count)
+
+
+class ResultBlock(db.Model):
+  __tablename__ = 'result_blocks'
+
+  result_id = db.Column(
+      db.Integer,
+      db.ForeignKey('results.id', ondelete='CASCADE'),
+      primary_key=True
+  )
+  hash = db.Column(db.String(40), primary_key=True)
+  occurrences = db.Column(db.Integer, nullable=False)
+  word_count = db.Column(JSON, nullable=False)
+
+  def __repr__(self):
+    return '<block {} x{}>'.format(self.hash, self.occurrences)
+
+
+class DomainWordCount(db.Model):
+  # word counts summed over the latest result of every url on a domain
+  __tablename__ = 'domain_word_counts'
+  __table_args__ = (
+      db.Index('ix_domain_word_counts_top', 'domain', 'stop_word', 'count'),
+  )
+
+  domain = db.Column(db.String(), primary_key=True)
+  word = db.Column(db.String(), primary_key=True)
+  stop_word = db.Column(db.Boolean, nullable=False)
+  count = db.Column(db.BigInteger, nullable=False)
+
+  def __repr__(self):
+    return '<word {} {} {}>'.format(self.domain, self.word, self.count)
+
+
+class DayWordCount(db.Model):
+  # word counts summed over the latest result of every url fetched on a day
+  __tablename__ = 'day_word_counts'
+  __table_args__ = (
+      db.Index('ix_day_word_counts_top', 'day', 'stop_word', 'count'),
+  )
+
+  day = db.Column(db.Date, primary_key=True)
+  word = db.Column(db.String(), primary_key=True)
+  stop_word = db.Column(db.Boolean, nullable=False)
+  count = db.Column(db.BigInteger, nullable=False)
+
+  def __repr__(self):
+    return '<word {} {} {}>'.format(self.day, self.word, self.count)
+
+
+class Vocabulary(db.Model):
+  __tablename__ = 'vocabulary'
+
+  id = db.Column(db.Integer, primary_key=True)
+  word = db.Column(db.String(), nullable=False, unique=True)
+
+  @staticmethod
+  def remember(rows):
+    if len(word_ids) > app.config['VOCABULARY_CACHE_SIZE']:
+      word_ids.clear()
+      id_words.clear()
+    for id, word in rows:
+      word_ids[word] = id
+      id_words[id] = word
+
+  @classmethod
+  def ids(cls, words):
+    found = {}
+    missing = []
+    for word in words:
+      id = word_ids.get(word)
+      if id is None:
+        missing.append(word)
+      else:
+        found[word] = id
+    if missing:
+      # in a fixed order, so concurrent workers inserting the same new words
+      # don't deadlock on the unique index
+      missing.sort()
+      # assign ids outside the caller's transaction, so a rollback there
+      # can't leave ids in the cache that were never committed
+      with db.engine.begin() as connection:
+        connection.execute(
+            upsert(cls.__table__).on_conflict_do_nothing(
+                index_elements=['word']
+            ),
+            [{'word': word} for word in missing]
+        )
+        rows = []
+        for i in range(0, len(missing), 500):
+          rows.extend(connection.execute(
+              db.select([cls.id, cls.word])
+              .where(cls.word.in_(missing[i:i + 500]))
+          ))
+      found.update((word, id) for id, word in rows)
+      cls.remember(rows)
+    return found
+
+  @classmethod
+  def words(cls, ids):
+    try:
+      return list(map(id_words.__getitem__, ids))
+    except KeyError:
+      pass
+    found = {}
+    missing = []
+    for id in set(ids):
+      word = id_words.get(id)
+      if word is None:
+        missing.append(id)
+      else:
+        found[id] = word
+    rows = []
+    for i in range(0, len(missing), 500):
+      rows.extend(
+          db.session.query(cls.id, cls.word)
+          .filter(cls.id.in_(missing[i:i + 500]))
+      )
+    found.update(rows)
+    cls.remember(rows)
+    return [found[id] for id in ids]
+
+  def __repr__(self):
+    return '<word {} {}>'.format(self.id, self.word)
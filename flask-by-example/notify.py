@@ -0,0 +1,137 @@
+import asyncio
+import json
+import logging
+import time
+from collections import defaultdict
+
+from redis.exceptions import RedisError
+from rq import get_current_job
+from rq.compat import as_text
+from rq.exceptions import NoSuchJobError
+from rq.job import Job, JobStatus, unpickle
+
+logger = logging.getLogger(__name__)
+failed = {'error': ['Unable to process this url.']}
+
+
+def channel(job_id):
+  return 'wordcount:done:{}'.format(job_id)
+
+
+def publish(connection, value):
+  job = get_current_job()
+  if job is not None:
+    connection.publish(channel(job.id), json.dumps(value))
+
+
+def done(job):
+  # (True, value) once the job is done, otherwise (False, None)
+  if job.is_finished:
+    return True, job.result
+  if job.is_failed:
+    return True, failed
+  return False, None
+
+
+def wait_for(connection, job, timeout):
+  # subscribe before checking the status so a job finishing in between is
+  # still seen; returns (True, value) once done or (False, None) on timeout
+  pubsub = connection.pubsub(ignore_subscribe_messages=True)
+  pubsub.subscribe(channel(job.id))
+  try:
+    finished, value = done(job)
+    if finished:
+      return finished, value
+    deadline = time.time() + timeout
+    while True:
+      remaining = deadline - time.time()
+      if remaining <= 0:
+        # jobs publish before rq marks them finished, so a subscription
+        # made in between never hears of it
+        return done(job)
+      message = pubsub.get_message(timeout=min(remaining, 1.0))
+      if message is not None:
+        return True, json.loads(message['data'])
+  finally:
+    pubsub.close()
+
+
+async def job_done(connection, job_id):
+  # done() through an asyncio client
+  status, result = await job_status(connection, job_id)
+  if status == JobStatus.FINISHED:
+    return True, result
+  if status == JobStatus.FAILED:
+    return True, failed
+  return False, None
+
+
+async def job_status(connection, job_id):
+  # (status, result) of a job through an asyncio client, read from the job
+  # hash like Job.fetch but without the job's data
+  status, result = await connection.hmget(
+      Job.key_for(job_id), 'status', 'result'
+  )
+  if status is None:
+    raise NoSuchJobError('No such job: {}'.format(job_id))
+  return as_text(status), unpickle(result) if result else None
+
+
+class Listener(object):
+  # one pattern subscription per asyncio process, handed out to every
+  # request waiting on a job, rather than a redis connection per request
+
+  def __init__(self, connection):
+    self.connection = connection
+    self.waiters = defaultdict(set)
+    self.task = None
+
+  def start(self):
+    self.task = asyncio.ensure_future(self.listen())
+
+  async def stop(self):
+    self.task.cancel()
+    try:
+      await self.task
+    except asyncio.CancelledError:
+      pass
+
+  async def listen(self):
+    prefix = channel('')
+    while True:
+      pubsub = self.connection.pubsub(ignore_subscribe_messages=True)
+      try:
+        await pubsub.psubscribe(channel('*'))
+        async for message in pubsub.listen():
+          job_id = as_text(message['channel'])[len(prefix):]
+          for future in self.waiters.pop(job_id, ()):
+            if not future.done():
+              future.set_result(json.loads(message['data']))
+      except RedisError:
+        # waiters time out and check the job's status again meanwhile
+        logger.exception('Lost the job notification subscription')
+        await asyncio.sleep(1)
+      finally:
+        await pubsub.reset()
+
+  async def wait_for(self, job_id, timeout):
+    # like wait_for(): registered before checking the status, so a job
+    # finishing in between is still seen
+    future = asyncio.get_event_loop().create_future()
+    self.waiters[job_id].add(future)
+    try:
+      finished, value = await job_done(self.connection, job_id)
+      if finished:
+        return finished, value
+      try:
+        return True, await asyncio.wait_for(future, timeout)
+      except asyncio.TimeoutError:
+        # as in wait_for(), the message may have gone out before the
+        # status changed
+        return await job_done(self.connection, job_id)
+    finally:
+      waiters = self.waiters.get(job_id)
+      if waiters is not None:
+        waiters.discard(future)
+        if not waiters:
+          del self.waiters[job_id]
@@ -0,0 +1,62 @@
+import struct
+import sys
+from array import array
+from itertools import chain, compress, islice
+
+# count width in bytes, number of words
+header = struct.Struct('<BI')
+# keep (not stop word) selectors for each mask byte, low bit first
+keep_flags = [
+    tuple(not byte >> bit & 1 for bit in range(8)) for byte in range(256)
+]
+
+
+def to_bytes(values):
+  # stored little-endian whatever the host
+  if sys.byteorder == 'big':
+    values = array(values.typecode, values)
+    values.byteswap()
+  return values.tobytes()
+
+
+def from_bytes(typecode, data):
+  values = array(typecode)
+  values.frombytes(data)
+  if sys.byteorder == 'big':
+    values.byteswap()
+  return values
+
+
+def pack(ids, counts, stop_words):
+  # word ids, counts and a stop word bitmask in parallel, one entry per word
+  typecode = 'H' if max(counts, default=0) < 1 << 16 else 'I'
+  mask = bytearray((len(ids) + 7) // 8)
+  for i, stop in enumerate(stop_words):
+    if stop:
+      mask[i >> 3] |= 1 << (i & 7)
+  return b''.join([
+      header.pack(array(typecode).itemsize, len(ids)),
+      to_bytes(array('I', ids)),
+      to_bytes(array(typecode, counts)),
+      bytes(mask),
+  ])
+
+
+def unpack(data):
+  data = memoryview(data)
+  width, n = header.unpack_from(data)
+  start = header.size
+  ids = from_bytes('I', data[start:start + 4 * n])
+  start += 4 * n
+  typecode = 'H' if width == 2 else 'I'
+  counts = from_bytes(typecode, data[start:start + width * n])
+  start += width * n
+  mask = data[start:start + (n + 7) // 8]
+  keep = islice(chain.from_iterable(map(keep_flags.__getitem__, mask)), n)
+  return ids, counts, keep
+
+
+def decode(words, counts, keep):
+  # the counts with and without stop words
+  result_all = dict(zip(words, counts))
+  return result_all, dict(compress(result_all.items(), keep))
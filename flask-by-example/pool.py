@@ -0,0 +1,140 @@
+import math
+import multiprocessing
+import os
+import signal
+import time
+from datetime import datetime
+
+from rq import Queue
+
+import worker
+
+
+def run_worker():
+  # own process group, so a ctrl-c on the pool reaches the workers only once,
+  # as the warm shutdown the pool forwards
+  os.setpgrp()
+  worker.work()
+
+
+class Pool(object):
+
+  def __init__(
+      self, connection, queues, min_workers=1, max_workers=None,
+      jobs_per_worker=5, max_latency=10.0, interval=5.0, idle_checks=3,
+      on_tick=None
+  ):
+    self.connection = connection
+    self.queues = [Queue(name, connection=connection) for name in queues]
+    self.min_workers = min_workers
+    self.max_workers = max_workers or os.cpu_count() or 1
+    self.jobs_per_worker = jobs_per_worker
+    self.max_latency = max_latency
+    self.interval = interval
+    self.idle_checks = idle_checks
+    self.on_tick = on_tick
+    self.context = multiprocessing.get_context('fork')
+    self.processes = []
+    self.stopping = []
+    self.idle = 0
+    self.draining = False
+
+  @classmethod
+  def from_config(cls, connection, queues, config, on_tick=None):
+    return cls(
+        connection,
+        queues,
+        min_workers=config['POOL_MIN_WORKERS'],
+        max_workers=config['POOL_MAX_WORKERS'],
+        jobs_per_worker=config['POOL_JOBS_PER_WORKER'],
+        max_latency=config['POOL_MAX_LATENCY'],
+        interval=config['POOL_INTERVAL'],
+        on_tick=on_tick
+    )
+
+  def depth(self):
+    return sum(len(queue) for queue in self.queues)
+
+  def latency(self):
+    # age of the oldest job still waiting on any queue
+    oldest = 0.0
+    now = datetime.utcnow()
+    for queue in self.queues:
+      job_ids = queue.get_job_ids(0, 1)
+      if not job_ids:
+        continue
+      job = queue.fetch_job(job_ids[0])
+      if job is not None and job.enqueued_at is not None:
+        oldest = max(oldest, (now - job.enqueued_at).total_seconds())
+    return oldest
+
+  def desired(self, depth, latency):
+    current = len(self.processes)
+    wanted = current
+    if depth > current * self.jobs_per_worker or latency > self.max_latency:
+      wanted = max(current + 1, math.ceil(depth / self.jobs_per_worker))
+      self.idle = 0
+    elif depth == 0:
+      # scale down one worker at a time, after a few idle checks in a row
+      self.idle += 1
+      if self.idle >= self.idle_checks:
+        wanted = current - 1
+        self.idle = 0
+    else:
+      self.idle = 0
+    return min(max(wanted, self.min_workers), self.max_workers)
+
+  def start(self):
+    process = self.context.Process(target=run_worker)
+    process.start()
+    self.processes.append(process)
+
+  def stop(self, process):
+    # rq finishes the job in hand on the first SIGTERM
+    os.kill(process.pid, signal.SIGTERM)
+    self.processes.remove(process)
+    self.stopping.append(process)
+
+  def scale_to(self, n):
+    while len(self.processes) < n:
+      self.start()
+    while len(self.processes) > n:
+      self.stop(self.processes[-1])
+
+  def reap(self):
+    for process in self.processes + self.stopping:
+      if not process.is_alive():
+        process.join()
+        if process in self.processes:
+          self.processes.remove(process)
+        else:
+          self.stopping.remove(process)
+
+  def drain(self, signum, frame):
+    self.draining = True
+
+  def run(self):
+    signal.signal(signal.SIGTERM, self.drain)
+    signal.signal(signal.SIGINT, self.drain)
+    self.scale_to(self.min_workers)
+    while not self.draining:
+      self.reap()
+      if self.on_tick is not None:
+        self.on_tick()
+      self.scale_to(self.desired(self.depth(), self.latency()))
+      deadline = time.time() + self.interval
+      while not self.draining and time.time() < deadline:
+        time.sleep(0.1)
+    for process in list(self.processes):
+      self.stop(process)
+    for process in self.stopping:
+      process.join()
+
+
+if __name__ == '__main__':
+  worker.preload()
+  from app import app, scheduler
+  pool = Pool.from_config(
+      worker.conn, worker.listen, app.config, on_tick=scheduler.dispatch
+  )
+  pool.run()
@@ -0,0 +1,132 @@
+from collections import Counter, defaultdict
+from datetime import datetime
+
+from app import db
+from models import Result, DomainWordCount, DayWordCount, upsert
+from scheduler import host_of
+from urls import url_hash
+
+
+class Previous(object):
+  # what a url contributed to the rollups before it is saved again
+
+  def __init__(self, day, result_all, result_no_stop_words):
+    self.day = day
+    self.result_all = result_all
+    self.result_no_stop_words = result_no_stop_words
+
+
+def previous_many(urls):
+  # lock the rows so concurrent re-analyses of a url apply their changes in
+  # turn rather than both against the same old counts
+  hashes = {url_hash(url): url for url in urls}
+  found = {}
+  query = Result.query.options(db.undefer_group('counts')).filter(
+      Result.url_hash.in_(list(hashes))
+  ).order_by(Result.id).with_for_update()
+  for result in query:
+    day = result.fetched_at.date() if result.fetched_at else None
+    found[result.url_hash] = Previous(
+        day, result.result_all, result.result_no_stop_words
+    )
+  return {
+      url: found.get(hash, Previous(None, {}, {}))
+      for hash, url in hashes.items()
+  }
+
+
+def previous(url):
+  # two first analyses of a url would both find nothing to lock and add
+  # their full counts; the write-behind writer saves its batches one at a
+  # time, so previous_many needs no such lock
+  Result.lock(url)
+  return previous_many([url])[url]
+
+
+def increment(model, key, counts, stop_words):
+  if not counts:
+    return
+  table = model.__table__
+  stmt = upsert(table)
+  stmt = stmt.on_conflict_do_update(
+      index_elements=list(key) + ['word'],
+      set_={'count': table.c.count + stmt.excluded['count']}
+  )
+  # a fixed order keeps concurrent workers from deadlocking on the rows
+  db.session.execute(stmt, [
+      dict(key, word=word, stop_word=word in stop_words, count=count)
+      for word, count in sorted(counts.items())
+  ])
+  emptied = [word for word, count in counts.items() if count < 0]
+  if emptied:
+    model.query.filter_by(**key).filter(
+        model.word.in_(emptied), model.count <= 0
+    ).delete(synchronize_session=False)
+
+
+class Changes(object):
+  # rollup changes of any number of saved results, applied once per domain
+  # and day
+
+  def __init__(self):
+    self.domains = defaultdict(Counter)
+    self.days = defaultdict(Counter)
+    self.stop_words = set()
+
+  def add(self, url, previous, result_all, result_no_stop_words):
+    self.stop_words.update(
+        word for word in result_all if word not in result_no_stop_words
+    )
+    self.stop_words.update(
+        word for word in previous.result_all
+        if word not in previous.result_no_stop_words
+    )
+    domain = self.domains[host_of(url)]
+    domain.update(result_all)
+    domain.subtract(previous.result_all)
+    if previous.day is not None:
+      self.days[previous.day].subtract(previous.result_all)
+    self.days[datetime.utcnow().date()].update(result_all)
+
+  def save(self):
+    for domain, counts in sorted(self.domains.items()):
+      increment(
+          DomainWordCount, {'domain': domain}, nonzero(counts),
+          self.stop_words
+      )
+    for day, counts in sorted(self.days.items()):
+      increment(DayWordCount, {'day': day}, nonzero(counts), self.stop_words)
+
+
+def nonzero(counts):
+  return {word: count for word, count in counts.items() if count}
+
+
+def update(url, previous, result_all, result_no_stop_words):
+  changes = Changes()
+  changes.add(url, previous, result_all, result_no_stop_words)
+  changes.save()
+
+
+def top(model, query, count, k, offset, stop_words):
+  if not stop_words:
+    query = query.filter(db.not_(model.stop_word))
+  query = query.order_by(count.desc(), model.word).offset(offset).limit(k)
+  return [(word, int(count)) for word, count in query]
+
+
+def top_domain_words(domain, k=10, offset=0, stop_words=False):
+  query = db.session.query(
+      DomainWordCount.word, DomainWordCount.count
+  ).filter_by(domain=domain)
+  return top(
+      DomainWordCount, query, DomainWordCount.count, k, offset, stop_words
+  )
+
+
+def top_day_words(first, last, k=10, offset=0, stop_words=False):
+  count = db.func.sum(DayWordCount.count)
+  query = db.session.query(DayWordCount.word, count).filter(
+      DayWordCount.day >= first, DayWordCount.day <= last
+  ).group_by(DayWordCount.word)
+  return top(DayWordCount, query, count, k, offset, stop_words)
@@ -0,0 +1,147 @@
+from urllib.parse import urlsplit
+
+from rq import Queue
+from rq.job import Job, JobStatus
+
+# workers listen in this order, so interactive jobs always go first; the old
+# default queue is still drained after an upgrade
+queues = ['interactive', 'bulk', 'default']
+
+# queue job ids on a submitter's backlog; a submitter is on the ring exactly
+# when its backlog is not empty
+push_backlog = '''
+local before = redis.call('LLEN', KEYS[2])
+for i = 2, #ARGV do
+  redis.call('RPUSH', KEYS[2], ARGV[i])
+end
+if before == 0 and #ARGV > 1 then
+  redis.call('RPUSH', KEYS[1], ARGV[1])
+end
+'''
+
+# take the next job of the next submitter on the ring, round robin
+pop_backlog = '''
+for i = 1, redis.call('LLEN', KEYS[1]) do
+  local submitter = redis.call('LPOP', KEYS[1])
+  local job_id = redis.call('LPOP', ARGV[1] .. submitter)
+  if job_id then
+    if redis.call('LLEN', ARGV[1] .. submitter) > 0 then
+      redis.call('RPUSH', KEYS[1], submitter)
+    end
+    return {submitter, job_id}
+  end
+end
+return nil
+'''
+
+
+def host_of(url):
+  try:
+    return (urlsplit(url).hostname or '').lower()
+  except ValueError:
+    return ''
+
+
+class Scheduler(object):
+  prefix = 'wordcount:scheduler:'
+
+  def __init__(
+      self, connection, bulk_depth=20, host_concurrency=2, host_interval=1.0,
+      slot_ttl=600
+  ):
+    self.connection = connection
+    self.interactive = Queue('interactive', connection=connection)
+    self.bulk = Queue('bulk', connection=connection)
+    self.bulk_depth = bulk_depth
+    self.host_concurrency = host_concurrency
+    self.host_interval = host_interval
+    self.slot_ttl = slot_ttl
+    self.ring = self.prefix + 'submitters'
+    self.backlog_prefix = self.prefix + 'backlog:'
+    self.push_backlog = connection.register_script(push_backlog)
+    self.pop_backlog = connection.register_script(pop_backlog)
+
+  @classmethod
+  def from_config(cls, connection, config):
+    return cls(
+        connection,
+        bulk_depth=config['SCHEDULER_BULK_DEPTH'],
+        host_concurrency=config['SCHEDULER_HOST_CONCURRENCY'],
+        host_interval=config['SCHEDULER_HOST_INTERVAL']
+    )
+
+  def submit(self, func, url, result_ttl):
+    # interactive jobs skip the backlog and the host limits but still take
+    # a host slot, so bulk dispatching backs off from the same origin
+    self.acquire(host_of(url), force=True)
+    return self.interactive.enqueue_call(
+        func=func, args=(url,), result_ttl=result_ttl
+    )
+
+  def submit_bulk(self, func, urls, submitter, result_ttl):
+    with self.connection.pipeline() as pipe:
+      job_ids = []
+      for url in urls:
+        job = self.bulk.create_job(func, args=(url,), result_ttl=result_ttl)
+        job.set_status(JobStatus.DEFERRED, pipeline=pipe)
+        job.save(pipeline=pipe)
+        job_ids.append(job.id)
+      self.push_backlog(
+          keys=[self.ring, self.backlog_prefix + submitter],
+          args=[submitter] + job_ids,
+          client=pipe
+      )
+      pipe.execute()
+    self.dispatch()
+    return job_ids
+
+  def dispatch(self):
+    # top the bulk queue up to its depth, taking submitters in turn and
+    # skipping jobs whose host is busy
+    room = self.bulk_depth - len(self.bulk)
+    skipped = 0
+    while room > 0 and skipped < self.bulk_depth:
+      popped = self.pop_backlog(keys=[self.ring], args=[self.backlog_prefix])
+      if popped is None:
+        break
+      submitter, job_id = [value.decode() for value in popped]
+      try:
+        job = Job.fetch(job_id, connection=self.connection)
+      except Exception:
+        continue
+      if not self.acquire(host_of(job.args[0])):
+        self.push_backlog(
+            keys=[self.ring, self.backlog_prefix + submitter],
+            args=[submitter, job_id]
+        )
+        skipped += 1
+        continue
+      self.bulk.enqueue_job(job)
+      room -= 1
+
+  def _host_keys(self, host):
+    return (
+        self.prefix + 'host:{}:active'.format(host),
+        self.prefix + 'host:{}:next'.format(host)
+    )
+
+  def acquire(self, host, force=False):
+    active, next_allowed = self._host_keys(host)
+    if not force:
+      if int(self.connection.get(active) or 0) >= self.host_concurrency:
+        return False
+      interval = int(self.host_interval * 1000)
+      if interval and not self.connection.set(
+          next_allowed, 1, px=interval, nx=True
+      ):
+        return False
+    with self.connection.pipeline() as pipe:
+      pipe.incr(active)
+      pipe.expire(active, self.slot_ttl)
+      pipe.execute()
+    return True
+
+  def release(self, url):
+    active, _ = self._host_keys(host_of(url))
+    if self.connection.decr(active) < 0:
+      self.connection.delete(active)
@@ -1,3 +1,6 @@
+import re
+from collections import Counter
+
 stops = [
     'i', 'me', 'my', 'myself', 'we', 'our', 'ours', 'ourselves', 'you',
     'your', 'yours', 'yourself', 'yourselves', 'he', 'him', 'his',
@@ -17,3 +20,35 @@ stops = [
     'function', 'js', 'd', 'script', '\'script', 'fjs', 'document', 'r',
     'b', 'g', 'e', '\'s', 'c', 'f', 'h', 'l', 'k'
 ]
+
+
+STOP_WORDS = {'english': frozenset(stops)}
+
+# a token is a word if it contains at least one letter
+is_word = re.compile('[A-Za-z]').search
+
+
+def stop_words_for(language):
+  if language not in STOP_WORDS:
+    from nltk.corpus import stopwords
+    STOP_WORDS[language] = frozenset(stopwords.words(language))
+  return STOP_WORDS[language]
+
+
+class StopWordFilter(object):
+
+  def __init__(self, language='english'):
+    self.language = language
+    self.stops = stop_words_for(language)
+
+  def count_words(self, tokens, word_count):
+    # filter() and Counter.update() both run in C, one batch of tokens at a
+    # time, with no per-token Python bytecode
+    word_count.update(filter(is_word, tokens))
+
+  def without_stop_words(self, word_count):
+    # stop words are dropped once per distinct word rather than per token
+    stops = self.stops
+    return Counter(
+        {w: c for w, c in word_count.items() if w.lower() not in stops}
+    )
@@ -0,0 +1,188 @@
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from fetch import BodyTooLarge, DiskCache, Fetcher
+
+BODY = b'<html><body><p>The quick brown fox.</p></body></html>'
+ETAG = '"v1"'
+
+
+class Handler(BaseHTTPRequestHandler):
+  # a few pages, each misbehaving in one way
+  protocol_version = 'HTTP/1.1'
+  seen = []
+
+  def do_GET(self):
+    self.seen.append((self.path, dict(self.headers)))
+    getattr(self, 'page_' + self.path.strip('/'))()
+
+  def log_message(self, *args):
+    pass
+
+  def send(self, status, headers, body=b''):
+    self.send_response(status)
+    for name, value in headers.items():
+      self.send_header(name, value)
+    self.end_headers()
+    self.wfile.write(body)
+
+  def page_plain(self):
+    self.send(200, {'Content-Length': len(BODY)}, BODY)
+
+  def page_etag(self):
+    if self.headers.get('If-None-Match') == ETAG:
+      self.send(304, {'ETag': ETAG, 'Last-Modified': 'Tue, 01 Jan 2030'})
+    else:
+      self.send(200, {
+          'Content-Type': 'text/html; charset=utf-8',
+          'Content-Length': len(BODY),
+          'ETag': ETAG,
+      }, BODY)
+
+  def page_large(self):
+    self.send(200, {'Content-Length': 1024 * 1024}, b'x' * 1024 * 1024)
+
+  def page_large_unsized(self):
+    # no Content-Length, so the body runs until the connection closes
+    self.close_connection = True
+    self.send_response(200)
+    self.send_header('Connection', 'close')
+    self.end_headers()
+    for _ in range(64):
+      self.wfile.write(b'x' * 16 * 1024)
+
+  def page_slow_headers(self):
+    time.sleep(1)
+    self.send(200, {'Content-Length': len(BODY)}, BODY)
+
+  def page_slow_body(self):
+    self.send_response(200)
+    self.send_header('Content-Length', len(BODY))
+    self.end_headers()
+    self.wfile.write(BODY[:10])
+    self.wfile.flush()
+    time.sleep(1)
+    self.wfile.write(BODY[10:])
+
+
+class FetchTest(unittest.TestCase):
+
+  @classmethod
+  def setUpClass(cls):
+    cls.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    cls.server.daemon_threads = True
+    threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+    cls.base = 'http://127.0.0.1:{}/'.format(cls.server.server_port)
+
+  @classmethod
+  def tearDownClass(cls):
+    cls.server.shutdown()
+    cls.server.server_close()
+
+  def setUp(self):
+    Handler.seen = []
+    self.directory = tempfile.mkdtemp(prefix='wordcount-fetch-')
+    self.addCleanup(shutil.rmtree, self.directory)
+
+  def fetcher(self, **kwargs):
+    kwargs.setdefault('connect_timeout', 0.2)
+    kwargs.setdefault('read_timeout', 0.2)
+    kwargs.setdefault('retries', 0)
+    return Fetcher(**kwargs)
+
+  def test_get(self):
+    r = self.fetcher(max_body_size=1024).get(self.base + 'plain')
+    self.assertEqual(r.status_code, 200)
+    self.assertEqual(r.content, BODY)
+
+  def test_connect_timeout(self):
+    # a listener whose backlog is full never completes another handshake
+    listener = socket.socket()
+    self.addCleanup(listener.close)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(0)
+    url = 'http://127.0.0.1:{}/'.format(listener.getsockname()[1])
+    for _ in range(4):
+      waiting = socket.socket()
+      self.addCleanup(waiting.close)
+      waiting.setblocking(False)
+      waiting.connect_ex(listener.getsockname())
+    with self.assertRaises(requests.exceptions.ConnectTimeout):
+      self.fetcher().get(url)
+
+  def test_read_timeout_before_headers(self):
+    # through the retrying adapter, which wraps the timeout once out of
+    # retries
+    with self.assertRaises(requests.exceptions.ConnectionError) as raised:
+      self.fetcher().get(self.base + 'slow_headers')
+    self.assertIn('Read timed out', str(raised.exception))
+
+  def test_read_timeout_in_body(self):
+    with self.assertRaises(requests.exceptions.ConnectionError) as raised:
+      self.fetcher().get(self.base + 'slow_body')
+    self.assertIn('Read timed out', str(raised.exception))
+
+  def test_too_large_with_content_length(self):
+    fetcher = self.fetcher(max_body_size=1024)
+    with self.assertRaises(BodyTooLarge):
+      fetcher.get(self.base + 'large')
+
+  def test_too_large_without_content_length(self):
+    fetcher = self.fetcher(max_body_size=100 * 1024)
+    with self.assertRaises(BodyTooLarge):
+      fetcher.get(self.base + 'large_unsized')
+    r = fetcher.get(self.base + 'large_unsized', stream=True)
+    with self.assertRaises(BodyTooLarge):
+      for _ in fetcher.iter_content(r, 16 * 1024):
+        pass
+
+  def test_not_modified_from_disk(self):
+    fetcher = self.fetcher(cache=DiskCache(self.directory))
+    first = fetcher.get(self.base + 'etag')
+    self.assertEqual(first.content, BODY)
+    self.assertFalse(getattr(first, 'from_cache', False))
+    second = fetcher.get(self.base + 'etag')
+    self.assertEqual(Handler.seen[-1][1].get('If-None-Match'), ETAG)
+    self.assertEqual(second.status_code, 200)
+    self.assertTrue(second.from_cache)
+    self.assertEqual(second.content, BODY)
+    self.assertEqual(second.text, BODY.decode())
+    # the validators the 304 sent replace the stored ones
+    entry = fetcher.cache.get(self.base + 'etag')
+    self.assertEqual(entry['headers']['Last-Modified'], 'Tue, 01 Jan 2030')
+
+  def test_not_modified_streamed(self):
+    fetcher = self.fetcher(cache=DiskCache(self.directory))
+    r = fetcher.get(self.base + 'etag', stream=True)
+    self.assertEqual(b''.join(fetcher.iter_content(r, 16)), BODY)
+    r = fetcher.get(self.base + 'etag', stream=True)
+    self.assertTrue(r.from_cache)
+    self.assertEqual(b''.join(fetcher.iter_content(r, 16)), BODY)
+
+  def test_no_validators_not_stored(self):
+    fetcher = self.fetcher(cache=DiskCache(self.directory))
+    fetcher.get(self.base + 'plain')
+    self.assertIsNone(fetcher.cache.get(self.base + 'plain'))
+    self.assertEqual(os.listdir(self.directory), [])
+
+  def test_evicts_least_recently_used(self):
+    # room for one entry only
+    cache = DiskCache(self.directory, max_size=1024)
+    body = os.urandom(600)
+    for url in ('http://a.example/', 'http://b.example/'):
+      cache.write(url, {'ETag': ETAG}, zlib.compress(body), url)
+    self.assertIsNone(cache.get('http://a.example/'))
+    self.assertEqual(cache.get('http://b.example/')['body'], body)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,28 @@
+import hashlib
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+default_ports = {'http': 80, 'https': 443}
+
+
+def normalize_url(url):
+  try:
+    parts = urlsplit(url.strip())
+    port = parts.port
+  except ValueError:
+    # a bad port or an unclosed IPv6 bracket; the job's fetch reports it,
+    # so key the url as given
+    return url.strip()
+  scheme = parts.scheme.lower()
+  host = (parts.hostname or '').lower()
+  if ':' in host:
+    host = '[{}]'.format(host)
+  if port and port != default_ports.get(scheme):
+    host = '{}:{}'.format(host, port)
+  path = parts.path or '/'
+  query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+  # fragments never reach the server
+  return urlunsplit((scheme, host, path, query, ''))
+
+
+def url_hash(url):
+  return hashlib.sha1(normalize_url(url).encode('utf-8')).hexdigest()
@@ -0,0 +1,175 @@
+import os
+import re
+import codecs
+import math
+import multiprocessing
+import zlib
+from collections import Counter
+from functools import partial
+
+import nltk
+
+from metrics import null_timer
+from stop_words import is_word
+
+
+basedir = os.path.abspath(os.path.dirname(__file__))
+nltk_data = os.path.join(basedir, 'nltk_data')
+if nltk_data not in nltk.data.path:
+  nltk.data.path.append(nltk_data)
+
+
+# words the way the treebank tokenizer splits them: contractions come apart
+# ("don't" -> "do", "n't"; "it's" -> "it", "'s") while words joined by
+# hyphens, dots or slashes ("e-mail", "v3.4.5", "try/except") stay whole
+word_pattern = re.compile(r"""
+    \w+(?=n't\b)
+  | n't\b
+  | '(?:s|m|d|ll|re|ve)\b
+  | \w+(?:[-./]\w+)*
+""", re.VERBOSE | re.IGNORECASE)
+
+
+def nltk_tokenize(raw):
+  return nltk.word_tokenize(raw)
+
+
+def nltk_split(raw):
+  return nltk.sent_tokenize(raw)
+
+
+def nltk_tokenize_piece(sentence):
+  # word_tokenize is sent_tokenize followed by tokenizing every sentence on
+  # its own, so sentences can be counted anywhere and still add up the same
+  return nltk.word_tokenize(sentence, preserve_line=True)
+
+
+tokenizers = {
+    'nltk': (nltk_tokenize, nltk_split, nltk_tokenize_piece),
+    'regex': (word_pattern.findall, str.splitlines, word_pattern.findall),
+}
+
+
+def count_pieces(tokenizer, pieces):
+  _, _, tokenize_piece = tokenizers[tokenizer]
+  word_count = Counter()
+  for piece in pieces:
+    word_count.update(filter(is_word, tokenize_piece(piece)))
+  return word_count
+
+
+def split_blocks(raw, boundary=8, max_chars=4096):
+  # group lines into blocks, cutting after lines whose checksum says so, so
+  # an edit only moves the block boundaries next to it
+  blocks = []
+  lines = []
+  size = 0
+  for line in raw.splitlines():
+    line = line.strip()
+    if not line:
+      continue
+    lines.append(line)
+    size += len(line)
+    if zlib.crc32(line.encode('utf-8')) % boundary == 0 or size >= max_chars:
+      blocks.append('\n'.join(lines))
+      lines = []
+      size = 0
+  if lines:
+    blocks.append('\n'.join(lines))
+  return blocks
+
+
+def _split_complete(text):
+  # keep the trailing, possibly unfinished, line or word for the next chunk
+  cut = text.rfind('\n')
+  if cut == -1:
+    cut = max(text.rfind(' '), text.rfind('\t'))
+  if cut == -1:
+    return '', text
+  return text[:cut + 1], text[cut + 1:]
+
+
+class WordCounter(object):
+
+  def __init__(
+      self, stop_filter, extractor, tokenizer='nltk', processes=1,
+      parallel_min_chars=1024 * 1024
+  ):
+    self.stop_filter = stop_filter
+    self.extractor = extractor
+    self.tokenizer = tokenizer
+    self.tokenize, self.split = tokenizers[tokenizer][:2]
+    self.processes = processes
+    self.parallel_min_chars = parallel_min_chars
+
+  def count(self, html, timer=null_timer):
+    raw_word_count = Counter()
+    with timer('parse'):
+      raw = self.extractor.text(html)
+    if self.processes > 1 and len(raw) >= self.parallel_min_chars:
+      with timer('tokenize'):
+        self.count_parallel(raw, raw_word_count)
+    else:
+      self.count_tokens(raw, raw_word_count, timer)
+    with timer('count'):
+      no_stop_words_count = self.stop_filter.without_stop_words(raw_word_count)
+    return raw_word_count, no_stop_words_count
+
+  def blocks(self, html, timer=null_timer):
+    with timer('parse'):
+      return split_blocks(self.extractor.text(html))
+
+  def count_text(self, text, timer=null_timer):
+    word_count = Counter()
+    self.count_tokens(text, word_count, timer)
+    return word_count
+
+  def count_parallel(self, raw, word_count):
+    pieces = self.split(raw)
+    # a few chunks per process keeps them all busy until the end
+    size = max(math.ceil(len(pieces) / (self.processes * 4)), 1)
+    chunks = [pieces[i:i + size] for i in range(0, len(pieces), size)]
+    context = multiprocessing.get_context('fork')
+    with context.Pool(self.processes) as pool:
+      counts = pool.imap_unordered(
+          partial(count_pieces, self.tokenizer), chunks
+      )
+      for chunk_count in counts:
+        word_count.update(chunk_count)
+
+  def count_stream(
+      self, chunks, encoding=None, max_pending=1024 * 1024, timer=null_timer
+  ):
+    raw_word_count = Counter()
+    try:
+      decoder = codecs.getincrementaldecoder(encoding or 'utf-8')
+    except LookupError:
+      # a charset python doesn't know; requests' text falls back the same
+      decoder = codecs.getincrementaldecoder('utf-8')
+    decoder = decoder(errors='replace')
+    collector = self.extractor.parser()
+    pending = ''
+    for chunk in chunks:
+      with timer('parse'):
+        collector.feed(decoder.decode(chunk))
+        pending += collector.pop_text()
+      ready, pending = _split_complete(pending)
+      if not ready and len(pending) > max_pending:
+        ready, pending = pending, ''
+      if ready:
+        self.count_tokens(ready, raw_word_count, timer)
+    with timer('parse'):
+      collector.feed(decoder.decode(b'', final=True))
+      collector.close()
+      pending += collector.pop_text()
+    if pending:
+      self.count_tokens(pending, raw_word_count, timer)
+    with timer('count'):
+      no_stop_words_count = self.stop_filter.without_stop_words(raw_word_count)
+    return raw_word_count, no_stop_words_count
+
+  def count_tokens(self, text, word_count, timer):
+    with timer('tokenize'):
+      tokens = self.tokenize(text)
+    with timer('count'):
+      self.stop_filter.count_words(tokens, word_count)
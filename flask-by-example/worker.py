@@ -1,16 +1,60 @@
+import logging
 import os
+import threading
+import time
 
 import redis
 
-from rq import Worker, Queue, Connection
+from rq import Worker, SimpleWorker, Queue, Connection
 
-listen = ['default']
+from scheduler import Scheduler, queues
+
+logger = logging.getLogger(__name__)
+
+listen = queues
 
 redis_url = os.getenv('REDISTOGO_URL', 'redis://localhost:6379')
 
 conn = redis.from_url(redis_url)
 
-if __name__ == '__main__':
+worker_classes = {'fork': Worker, 'simple': SimpleWorker}
+
+
+def preload():
+  # import the job module and its heavy dependencies in the parent so that
+  # forked work horses (or a simple worker) start with them already loaded
+  os.environ.setdefault('PROCESS_ROLE', 'worker')
+  from app import warm_up
+  warm_up()
+
+
+def dispatch_periodically():
+  # a bulk job held back by its host's limits otherwise waits for the next
+  # submission or finished job, which may never come; the pool has its own
+  # tick for this
+  from app import app
+  # a connection of its own, never in use by the thread that forks
+  scheduler = Scheduler.from_config(redis.from_url(redis_url), app.config)
+
+  def run():
+    while True:
+      time.sleep(app.config['SCHEDULER_DISPATCH_INTERVAL'])
+      try:
+        scheduler.dispatch()
+      except Exception:
+        logger.exception('Unable to dispatch the bulk backlog')
+
+  threading.Thread(target=run, daemon=True).start()
+
+
+def work():
+  worker_class = worker_classes[os.getenv('WORKER_CLASS', 'fork')]
   with Connection(conn):
-    worker = Worker(list(map(Queue, listen)))
+    worker = worker_class(list(map(Queue, listen)))
     worker.work()
+
+
+if __name__ == '__main__':
+  preload()
+  dispatch_periodically()
+  work()
@@ -0,0 +1,167 @@
+import logging
+import os
+import pickle
+import signal
+import time
+
+if __name__ == '__main__':
+  # sizes the writer's database pool as a worker's, so it is set before app
+  # reads its config
+  os.environ.setdefault('PROCESS_ROLE', 'worker')
+
+from app import app, db
+from models import Result, ResultBlock, WordCount
+import rollups
+from urls import url_hash
+
+logger = logging.getLogger(__name__)
+
+
+class Pending(object):
+  # a counted page waiting to be written
+
+  def __init__(self, url, result_id, result_all, result_no_stop_words):
+    self.url = url
+    self.result_id = result_id
+    self.result_all = result_all
+    self.result_no_stop_words = result_no_stop_words
+
+
+def write(entries, pack=False, top_n=1000):
+  # the results of a batch, their rankings and rollup changes in one
+  # transaction; the last entry for a url wins
+  entries = list({url_hash(entry.url): entry for entry in entries}.values())
+  previous = rollups.previous_many([entry.url for entry in entries])
+  rows = []
+  for entry in entries:
+    row = Result.row(
+        entry.url, entry.result_all, entry.result_no_stop_words, pack
+    )
+    row['id'] = entry.result_id
+    rows.append(row)
+  ids = Result.save_many(rows)
+  result_ids = [ids[row['url_hash']] for row in rows]
+  WordCount.query.filter(
+      WordCount.result_id.in_(result_ids)
+  ).delete(synchronize_session=False)
+  # saved without blocks, so an incremental run must start from scratch
+  ResultBlock.query.filter(
+      ResultBlock.result_id.in_(result_ids)
+  ).delete(synchronize_session=False)
+  rankings = []
+  changes = rollups.Changes()
+  for result_id, entry in zip(result_ids, entries):
+    rankings.extend(
+        WordCount.ranking(result_id, entry.result_all, True, top_n)
+        + WordCount.ranking(
+            result_id, entry.result_no_stop_words, False, top_n
+        )
+    )
+    changes.add(
+        entry.url, previous[entry.url], entry.result_all,
+        entry.result_no_stop_words
+    )
+  db.session.bulk_insert_mappings(WordCount, rankings)
+  changes.save()
+  db.session.commit()
+
+
+class WriteBehind(object):
+  # jobs push their counts to a redis list and return straight away; a
+  # single writer process empties it in batches
+  prefix = 'wordcount:writeback:'
+
+  def __init__(
+      self, connection, batch_size=200, interval=0.5, pack=False,
+      top_n=1000, id_ttl=24 * 60 * 60
+  ):
+    self.connection = connection
+    self.batch_size = batch_size
+    self.interval = interval
+    self.pack = pack
+    self.top_n = top_n
+    self.id_ttl = id_ttl
+    self.key = self.prefix + 'pending'
+    self.stopping = False
+
+  @classmethod
+  def from_config(cls, connection, config):
+    return cls(
+        connection,
+        batch_size=config['WRITE_BEHIND_BATCH'],
+        interval=config['WRITE_BEHIND_INTERVAL'],
+        pack=config['RESULT_ENCODING'] == 'packed',
+        top_n=config['TOP_WORDS_STORED']
+    )
+
+  def result_id(self, url):
+    # the id the url's result will have once written, the same for every
+    # job on the url until then
+    hash = url_hash(url)
+    existing = db.session.query(Result.id).filter_by(url_hash=hash).scalar()
+    if existing is not None:
+      return existing
+    key = self.prefix + 'id:' + hash
+    allocated = self.connection.get(key)
+    if allocated is None:
+      self.connection.set(key, self.next_id(), nx=True, ex=self.id_ttl)
+      allocated = self.connection.get(key)
+    return int(allocated)
+
+  def next_id(self):
+    if db.engine.dialect.name == 'postgresql':
+      return Result.next_id()
+    # no sequences elsewhere, so count on from the highest stored id
+    counter = self.prefix + 'next_id'
+    self.connection.setnx(
+        counter, db.session.query(db.func.max(Result.id)).scalar() or 0
+    )
+    return self.connection.incr(counter)
+
+  def push(self, pending):
+    self.connection.rpush(self.key, pickle.dumps(pending))
+
+  def flush(self):
+    items = self.connection.lrange(self.key, 0, self.batch_size - 1)
+    if not items:
+      return 0
+    entries = [pickle.loads(item) for item in items]
+    try:
+      write(entries, self.pack, self.top_n)
+    except Exception:
+      db.session.rollback()
+      # write what can be written on its own rather than retry the batch
+      for entry in entries:
+        try:
+          write([entry], self.pack, self.top_n)
+        except Exception:
+          db.session.rollback()
+          logger.exception('Dropped the result of %s', entry.url)
+    # only this process takes from the head, jobs push to the tail
+    self.connection.ltrim(self.key, len(items), -1)
+    return len(items)
+
+  def stop(self, signum, frame):
+    self.stopping = True
+
+  def run(self):
+    signal.signal(signal.SIGTERM, self.stop)
+    signal.signal(signal.SIGINT, self.stop)
+    flushed_at = time.time()
+    while not self.stopping:
+      if (
+          self.connection.llen(self.key) >= self.batch_size
+          or time.time() - flushed_at >= self.interval
+      ):
+        self.flush()
+        flushed_at = time.time()
+      else:
+        time.sleep(min(self.interval / 10, 0.05))
+    while self.flush():
+      pass
+
+
+if __name__ == '__main__':
+  from app import conn
+  logging.basicConfig(level=logging.INFO)
+  WriteBehind.from_config(conn, app.config).run()